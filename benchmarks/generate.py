@@ -0,0 +1,154 @@
+"""
+Generate nginx access logs for benchmarks.
+
+The logs are rotated the way logrotate does it: ``access.log`` is the
+newest file, ``access.log.1`` the previous one and the older files are
+gzipped. A ``manifest.json`` next to them lists the files, their
+uncompressed sizes and request IDs that occur once, for selective queries.
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import gzip
+import json
+import os
+import random
+
+METHODS = ["GET"] * 8 + ["POST", "PUT"]
+PATHS = [
+    "/",
+    "/api/v1/orders",
+    "/api/v1/users",
+    "/api/v1/cart",
+    "/checkout",
+    "/static/app.js",
+    "/static/app.css",
+    "/images/logo.png",
+    "/search",
+    "/login",
+]
+STATUSES = ["200"] * 90 + ["301", "304", "404", "404", "499"] + ["500"] * 3
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/13.0.5 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:72.0) Gecko/20100101 Firefox/72.0",
+    "curl/7.68.0",
+]
+NEEDLES = 100
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_size(value):
+    """
+    Parse size like ``512M`` or ``2G`` as bytes.
+    """
+    units = {"K": 2**10, "M": 2**20, "G": 2**30}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+def generate(out_dir, size, days, files, gzip_files, seed=0):
+    rnd = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Rough number of lines, a line takes about 230 bytes
+    lines = max(size // 230, files)
+    step = timedelta(days=days) / lines
+    needle_lines = set(rnd.sample(range(lines), min(NEEDLES, lines)))
+    manifest = {"size": 0, "lines": lines, "days": days, "files": []}
+    needles = []
+
+    lineno = 0
+    for i in reversed(range(files)):
+        name = "access.log" + (f".{i}" if i else "")
+        opener = open
+        if i and i >= files - gzip_files:
+            name += ".gz"
+            opener = open_gzip
+
+        file_lines = lines // files + (i == 0) * (lines % files)
+        file_size = 0
+        with opener(os.path.join(out_dir, name), "wb") as f:
+            buf = []
+            for _ in range(file_lines):
+                request_id = f"{rnd.getrandbits(128):032x}"
+                if lineno in needle_lines:
+                    needles.append(request_id)
+
+                buf.append(get_line(rnd, START + step * lineno, request_id))
+                lineno += 1
+                if len(buf) == 10000:
+                    file_size += write_lines(f, buf)
+
+            file_size += write_lines(f, buf)
+
+        manifest["files"].append({"name": name, "size": file_size})
+        manifest["size"] += file_size
+
+    manifest["needles"] = needles
+    with open(os.path.join(out_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def open_gzip(name, mode):
+    # Level of the gzip command, which logrotate runs
+    return gzip.open(name, mode, compresslevel=6)
+
+
+def write_lines(f, buf):
+    data = "".join(buf).encode()
+    f.write(data)
+    buf.clear()
+    return len(data)
+
+
+def get_line(rnd, dt, request_id):
+    ip = ".".join(str(rnd.randrange(1, 255)) for _ in range(4))
+    path = rnd.choice(PATHS)
+    if path.startswith("/api"):
+        path += f"/{rnd.randrange(100000)}"
+
+    return (
+        f"{ip} - - [{dt.strftime('%d/%b/%Y:%H:%M:%S +0000')}] "
+        f'"{rnd.choice(METHODS)} {path}?request_id={request_id} HTTP/1.1" '
+        f"{rnd.choice(STATUSES)} {rnd.randrange(200, 50000)} "
+        f'"-" "{rnd.choice(USER_AGENTS)}"\n'
+    )
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("out_dir", help="Directory to write the logs to")
+    parser.add_argument(
+        "--size", default="1G", help="Total uncompressed size, e.g. 512M, 2G"
+    )
+    parser.add_argument("--days", type=int, default=14, help="Days covered")
+    parser.add_argument(
+        "--files", type=int, default=7, help="Number of rotated files"
+    )
+    parser.add_argument(
+        "--gzip-files", type=int, default=5, help="Number of gzipped files"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(
+        args.out_dir,
+        parse_size(args.size),
+        args.days,
+        args.files,
+        args.gzip_files,
+        args.seed,
+    )
+    print(f"{manifest['lines']} lines, {manifest['size']} bytes")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,230 @@
+"""
+Benchmark reindex and search on logs made by ``generate.py``.
+
+Every combination of ``NUM_WORKERS`` and ``MIN_CHUNK_BYTES`` gets a fresh
+index. Reindex throughput, index size, search latency percentiles and
+peak RSS of the largest process are written as JSON.
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import START, parse_size
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_NAME = "bench"
+
+CONF = """\
+{index_name}:
+    base_dir: "{base_dir}"
+    pattern: "access.log*"
+    datetime_regex: \\[([^\\]]*)
+    datetime_format: "%d/%b/%Y:%H:%M:%S %z"
+    date_granularity: hour
+"""
+
+
+def get_queries(manifest, repeat, seed=0):
+    """
+    Get ``{name: [search args, ...]}``, one list item per run.
+    """
+    rnd = random.Random(seed)
+    needles = rnd.sample(
+        manifest["needles"], min(repeat, len(manifest["needles"]))
+    )
+    # A day in the middle of the logs
+    day = (START + timedelta(days=manifest["days"] // 2)).strftime("%Y-%m-%d")
+    count_by = ["-e", r'" (5\d\d) ', "--count-by", "hour,group"]
+    # Options go first, the substring and the index name are the last ones
+    return {
+        # A request ID, found once in the whole logs
+        "selective": [[x] for x in needles],
+        "selective_day": [["-df", day, "-dt", day, x] for x in needles],
+        # Every line matches
+        "broad_count": [["-c", "HTTP/1.1"]] * repeat,
+        "broad_first": [["-n", "1000", "HTTP/1.1"]] * repeat,
+        "regex_count_by": [count_by] * repeat,
+    }
+
+
+def run_tough(args, env):
+    """
+    Run a tough command, returning wall time and peak RSS in bytes.
+
+    The RSS is the largest one among the process and its workers.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "tough", *args],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = status
+    if status:
+        raise RuntimeError(f"tough {' '.join(args)} failed: status {status}")
+
+    # Kilobytes on Linux, bytes on macOS
+    factor = 1 if sys.platform == "darwin" else 1024
+    return elapsed, rusage.ru_maxrss * factor
+
+
+def get_dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, x))
+        for dirpath, _, fnames in os.walk(path)
+        for x in fnames
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(manifest, num_workers, min_chunk_bytes, repeat, work_dir):
+    index_dir = os.path.join(work_dir, f"index-{num_workers}-{min_chunk_bytes}")
+    conf_name = os.path.join(work_dir, "conf.yaml")
+    env = {
+        **os.environ,
+        "CONF_NAME": conf_name,
+        "INDEX_DIR": index_dir,
+        "NUM_WORKERS": str(num_workers),
+        "MIN_CHUNK_BYTES": str(min_chunk_bytes),
+        "BLOCK_CACHE_SIZE": "0",
+        "BLOCK_CACHE_MEMORY": "0",
+        "SERVER_SOCKET": os.path.join(index_dir, "none.sock"),
+    }
+
+    seconds, rss = run_tough(["reindex"], env)
+    result = {
+        "num_workers": num_workers,
+        "min_chunk_bytes": min_chunk_bytes,
+        "reindex": {
+            "seconds": seconds,
+            "mb_per_second": manifest["size"] / 2**20 / seconds,
+            "peak_rss": rss,
+        },
+        "index_size": get_dir_size(index_dir),
+        "search": {},
+    }
+
+    for name, runs in get_queries(manifest, repeat).items():
+        timings = []
+        peak_rss = 0
+        for args in runs:
+            seconds, rss = run_tough(["search", *args, INDEX_NAME], env)
+            timings.append(seconds)
+            peak_rss = max(peak_rss, rss)
+
+        result["search"][name] = {
+            "runs": len(timings),
+            "p50": statistics.median(timings),
+            "p99": percentile(timings, 99),
+            "peak_rss": peak_rss,
+        }
+
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def int_list(value):
+    return [int(x) for x in value.split(",")]
+
+
+def size_list(value):
+    return [parse_size(x) for x in value.split(",")]
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("data_dir", help="Directory made by generate.py")
+    parser.add_argument(
+        "--workers",
+        type=int_list,
+        default=[os.cpu_count()],
+        help="NUM_WORKERS values, e.g. 1,2,4",
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        type=size_list,
+        default=[16 * 2**20],
+        help="MIN_CHUNK_BYTES values, e.g. 4M,16M",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="Runs of every query"
+    )
+    parser.add_argument("-o", "--output", help="JSON file, stdout by default")
+    args = parser.parse_args()
+
+    data_dir = os.path.abspath(args.data_dir)
+    with open(os.path.join(data_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    report = {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "commit": get_commit(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+        },
+        "data": {k: manifest[k] for k in ("size", "lines", "days", "files")},
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "conf.yaml"), "w") as f:
+            f.write(CONF.format(index_name=INDEX_NAME, base_dir=data_dir))
+
+        for num_workers, min_chunk_bytes in itertools.product(
+            args.workers, args.chunk_bytes
+        ):
+            result = bench(
+                manifest,
+                num_workers,
+                min_chunk_bytes,
+                args.repeat,
+                work_dir,
+            )
+            report["results"].append(result)
+            sys.stderr.write(
+                f"NUM_WORKERS={num_workers} "
+                f"MIN_CHUNK_BYTES={min_chunk_bytes}: "
+                f"reindex {result['reindex']['mb_per_second']:.1f} MB/s\n"
+            )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,6 +1,6 @@
 import pytest
 
-from tough.eol_mapper import EOLMapper
+from tough.eol_mapper import CompactEOLMapper, EOLMapper
 from tough.utils import ensure_index_dir
 
 
@@ -19,12 +19,17 @@ def create_source_file(index_name, create_data_file, data_dir):
     return _create_source_file
 
 
+@pytest.fixture(params=[EOLMapper, CompactEOLMapper])
+def mapper_class(request):
+    return request.param
+
+
 @pytest.fixture
-def create_eol_mapper(create_source_file, index_name):
+def create_eol_mapper(create_source_file, index_name, mapper_class):
     def _create_eol_mapper(contents):
         file_path = create_source_file(contents)
 
-        eol_mapper = EOLMapper(file_path, index_name)
+        eol_mapper = mapper_class(file_path, index_name)
         eol_mapper.open()
         line_length = 0
         with open(file_path, "r") as f:
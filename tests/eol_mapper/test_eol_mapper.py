@@ -1,6 +1,23 @@
+import datetime
+import itertools
+import os
+
+import indexed_gzip as igzip
 import pytest
 
-from tough.eol_mapper import MapLine
+from tough import get_indexes
+from tough.commands.reindex import run_reindex
+from tough.config import GZIP_COST_FACTOR
+from tough.eol_mapper import (
+    HEADER,
+    LEN_OFFSET,
+    CompactEOLMapper,
+    MapLine,
+    chunkify,
+    get_cost,
+    get_mapper,
+)
+from tough.opener import fopen
 
 
 @pytest.mark.parametrize("contents", ["a\n"])
@@ -88,3 +105,116 @@ def test_eol_map_4(create_eol_mapper, contents, lineno, expected_result):
 def test_eol_map_count_lines(create_eol_mapper, contents, expected):
     eol_mapper = create_eol_mapper(contents)
     assert eol_mapper.count_lines() == expected
+
+
+@pytest.mark.parametrize("contents", ["a\naa\naaa\n\n"])
+def test_eol_map_read_range(create_eol_mapper, contents):
+    eol_mapper = create_eol_mapper(contents)
+    assert list(eol_mapper.read_range(0, 4)) == [2, 5, 9, 10]
+    assert list(eol_mapper.read_range(1, 3)) == [5, 9]
+    assert eol_mapper.span(0, 4) == (0, 10)
+    assert eol_mapper.span(1, 3) == (2, 9)
+
+
+def test_eol_map_write_many(create_eol_mapper):
+    eol_mapper = create_eol_mapper("")
+    offsets = [1, 2**32, 2**40 - 1]
+    eol_mapper.open()
+    eol_mapper.write_many(0, offsets)
+    eol_mapper.write_many(3, [2**40 - 1])
+    eol_mapper.close()
+
+    assert eol_mapper.count_lines() == 4
+    assert list(eol_mapper.read_range(0, 4)) == [*offsets, 2**40 - 1]
+    assert eol_mapper.read(1) == MapLine(1, 1, 2**32 - 2)
+
+
+def test_compact_eol_map(create_source_file, index_name):
+    lengths = [1, 200, 3, 70_000, 5, 128, 127, 2]
+    file_path = create_source_file("".join("a" * x + "\n" for x in lengths))
+    offsets = list(itertools.accumulate(x + 1 for x in lengths))
+
+    eol_mapper = CompactEOLMapper(file_path, index_name, interval=3)
+    eol_mapper.open()
+    eol_mapper.write_many(0, offsets[:4])
+    eol_mapper.write_many(4, offsets[4:])
+
+    assert eol_mapper.count_lines() == len(lengths)
+    assert list(eol_mapper.read_range(0, 8)) == offsets
+    assert list(eol_mapper.read_range(2, 7)) == offsets[2:7]
+    for lineno, length in enumerate(lengths):
+        assert eol_mapper.read(lineno).length == length
+
+    eol_mapper.truncate(4)
+    assert eol_mapper.count_lines() == 4
+    eol_mapper.write_many(4, [offsets[3] + 10])
+    eol_mapper.close()
+
+    assert eol_mapper.read(4) == MapLine(4, offsets[3], 9)
+    assert eol_mapper.span(1, 5) == (offsets[0], offsets[3] + 10)
+    size = os.path.getsize(eol_mapper.map_fname)
+    assert size < len(offsets) * LEN_OFFSET + HEADER.size
+
+
+def test_get_mapper(create_eol_mapper, index_name, mapper_class):
+    create_eol_mapper("a\naa\n")
+    mapper = get_mapper(index_name, index_name)
+    assert type(mapper) is mapper_class
+    assert mapper.read(1) == MapLine(1, 2, 2)
+
+
+def test_chunkify_gzip(
+    create_data_file, data_dir, index_name, monkeypatch, capsys
+):
+    index_conf = {**get_indexes()[index_name], "gzip_spacing": 64 * 1024}
+    monkeypatch.setattr(
+        "tough.opener.get_indexes", lambda: {index_name: index_conf}
+    )
+    name = f"{index_name}.1.gz"
+    create_data_file(name, ((datetime.date(2019, 2, 20), 2000),))
+    run_reindex(index_name)
+
+    path = str(data_dir / index_name / name)
+    points = fopen(path, index_name).seek_points()
+    with igzip.IndexedGzipFile(path, spacing=64 * 1024) as f:
+        f.build_full_index()
+        assert points == [x[0] for x in f.seek_points()]
+
+    assert len(points) > 3
+
+    mapper = get_mapper(path, index_name)
+    chunks = list(chunkify([(path, [0, 1999])], index_name))
+    assert chunks[0][1] == 0
+    assert sum(x[2] for x in chunks) == 2000
+    for _, line_start, length, lines_to in chunks[1:]:
+        offset = mapper.span(line_start, line_start + 1)[0]
+        prev_offset = mapper.span(line_start - 1, line_start)[0]
+        assert any(prev_offset < x <= offset for x in points)
+        assert lines_to == 2000
+
+
+@pytest.mark.parametrize(
+    ("min_chunk_length", "lengths"),
+    [(1, [97, 2, 2, 2, 1]), (50, [97, 7]), (100, [100, 4])],
+)
+def test_chunkify_bytes(
+    create_eol_mapper, data_dir, index_name, min_chunk_length, lengths
+):
+    # Short lines, then long ones: a chunk ends at the first line after
+    # every 200 bytes, unless it would be shorter than min_chunk_length
+    create_eol_mapper("a\n" * 96 + ("b" * 99 + "\n") * 8)
+    path = str(data_dir / index_name / index_name)
+    chunks = list(chunkify([(path, None)], index_name, min_chunk_length, 200))
+    assert [x[2] for x in chunks] == lengths
+    assert [x[1] for x in chunks] == list(
+        itertools.accumulate([0, *lengths[:-1]])
+    )
+    assert all(x[3] == 104 for x in chunks)
+
+
+def test_get_cost(create_eol_mapper, index_name):
+    mapper = create_eol_mapper("a\n" * 10)
+    assert get_cost("access_log", mapper, 2, 7) == 10
+    assert get_cost("access_log.gz", mapper, 2, 7) == 10 * GZIP_COST_FACTOR
+    assert get_cost("access_log", mapper, 8, 20) == 4
+    assert get_cost("access_log", mapper, 7, 7) == 0
@@ -20,17 +20,25 @@ def index_name():
     return "access_log"
 
 
+@pytest.fixture
+def other_index_name():
+    """
+    Index with hourly date buckets, for searches across indexes.
+    """
+    return "other_log"
+
+
 @pytest.fixture
 def get_row():
     fmt = (
-        "127.0.0.1 - - [{date}:12:34:56 +0000] "
+        "127.0.0.1 - - [{date}:{time} +0000] "
         '"GET /{url} HTTP/1.1" 404 233 "-" "-"\n'
     )
 
-    def _get_row(date):
+    def _get_row(date, time="12:34:56"):
         str_date = date.strftime("%d/%b/%Y")
         url = uuid.uuid4()
-        return fmt.format(date=str_date, url=url)
+        return fmt.format(date=str_date, time=time, url=url)
 
     return _get_row
 
@@ -66,11 +74,12 @@ def provide_data(create_data_file, index_name):
 
 
 @pytest.fixture(autouse=True)
-def clean(data_dir, index_name):
+def clean(data_dir, index_name, other_index_name):
     yield
-    for f in (data_dir / index_name).glob("*"):
-        if f.name == ".gitkeep":
-            continue
+    for name in (index_name, other_index_name):
+        for f in (data_dir / name).glob("*"):
+            if f.name == ".gitkeep":
+                continue
 
-        os.remove(str(f))
+            os.remove(str(f))
     shutil.rmtree(INDEX_DIR, ignore_errors=True)
@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+
+import pytest
+
+from tough import Match, search
+from tough.commands.reindex import run_reindex
+from tough.commands.search import run_search
+from tough.opener import fopen
+from tough.pool import create_pool
+
+
+async def collect(matches):
+    return [x async for x in matches]
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def pool():
+    pool = create_pool(2)
+    yield pool
+    pool.close()
+    pool.join()
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(substring="HTTP/1.1"),
+        dict(substring="", regex=r"\[21/Feb"),
+        dict(substring="HTTP/1.1", date_from="2019-02-22", reverse=True),
+    ],
+)
+def test_search(provide_data, capsys, index_name, pool, kwargs):
+    run_reindex(index_name)
+    capsys.readouterr()
+    run_search(**{"regex": None, "index": index_name, **kwargs})
+    expected = capsys.readouterr().out.splitlines()
+
+    matches = run(
+        collect(search(index=index_name, pool=pool, window=2, **kwargs))
+    )
+    assert [x.line.decode() for x in matches] == expected
+    assert all(isinstance(x, Match) for x in matches)
+
+    with fopen(matches[0].path, index_name) as f:
+        f.seek(matches[0].offset)
+        assert f.readline().strip() == matches[0].line
+
+
+def test_search_limit(provide_data, index_name, pool):
+    run_reindex(index_name)
+
+    async def search_concurrently():
+        return await asyncio.gather(
+            *(
+                collect(search("HTTP", index_name, limit=limit, pool=pool))
+                for limit in (1, 15, 300, None)
+            )
+        )
+
+    results = run(search_concurrently())
+    assert [len(x) for x in results] == [1, 15, 300, 330]
+    assert results[3][:300] == results[2]
+    assert [x.lineno for x in results[1]] == list(range(15))
+
+
+@pytest.mark.parametrize(
+    "kwargs", [dict(substring=""), dict(substring="HTTP", limit=0)]
+)
+def test_search_fail(index_name, kwargs):
+    with pytest.raises(ValueError):
+        run(collect(search(index=index_name, **kwargs)))
+
+
+def test_search_indexes(
+    provide_data, data_dir, get_row, other_index_name, pool
+):
+    path = data_dir / other_index_name / other_index_name
+    path.write_text(get_row(datetime.date(2019, 2, 22), "08:00:00"))
+    run_reindex()
+
+    matches = run(collect(search("HTTP", "*_log", pool=pool)))
+    assert len(matches) == 331
+    assert [x.index for x in matches].count(other_index_name) == 1
+
+    with pytest.raises(ValueError, match="No index matches nope"):
+        run(collect(search("HTTP", "*_log,nope", pool=pool)))
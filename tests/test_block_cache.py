@@ -0,0 +1,106 @@
+import datetime
+import gzip
+import os
+
+import pytest
+
+from tough import get_indexes
+from tough.block_cache import BlockCache, BlockReader, file_key
+from tough.commands.reindex import run_reindex
+from tough.opener import fopen
+
+
+def test_memory_lru():
+    cache = BlockCache(None, memory_size=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    cache.put("d", b"d" * 11)
+
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"cccc"
+    assert cache.get("d") is None
+    assert cache.memory_used == 8
+
+
+def test_disk_lru(tmp_path):
+    cache = BlockCache(tmp_path, size=100)
+    for i in range(5):
+        cache.put(str(i), bytes(30))
+        os.utime(tmp_path / str(i), ns=(i, i))
+
+    assert cache.get("3") == bytes(30)
+    assert sorted(os.listdir(tmp_path)) == ["2", "3", "4"]
+    assert cache.disk_used == 90
+
+    cache = BlockCache(tmp_path, size=100)
+    cache.put("5", bytes(30))
+    assert cache.get("0") is None
+    assert sorted(os.listdir(tmp_path)) == ["3", "4", "5"]
+
+
+@pytest.fixture
+def gz_path(create_data_file, data_dir, index_name, monkeypatch):
+    index_conf = {**get_indexes()[index_name], "gzip_spacing": 64 * 1024}
+    monkeypatch.setattr(
+        "tough.opener.get_indexes", lambda: {index_name: index_conf}
+    )
+    name = f"{index_name}.1.gz"
+    create_data_file(name, ((datetime.date(2019, 2, 20), 2000),))
+    run_reindex(index_name)
+    return str(data_dir / index_name / name)
+
+
+def test_block_reader(gz_path, index_name, tmp_path):
+    with gzip.open(gz_path, "rb") as f:
+        data = f.read()
+
+    points = fopen(gz_path, index_name).seek_points()
+    assert len(points) > 3
+
+    def check_reads(reader):
+        start, end = points[1] - 10, points[1] + 90
+        reader.seek(start)
+        assert reader.read(100) == data[start:end]
+        assert reader.tell() == end
+        start, end = points[2] - 1, data.index(b"\n", points[2]) + 1
+        reader.seek(start)
+        assert reader.readline() == data[start:end]
+        reader.seek(0)
+        assert reader.read() == data
+        assert reader.read(10) == b""
+        assert reader.readline() == b""
+
+    cache = BlockCache(tmp_path, size=len(data))
+    opened = []
+
+    def open_file():
+        opened.append(gz_path)
+        return fopen(gz_path, index_name).open()
+
+    check_reads(BlockReader(open_file, cache, file_key(gz_path), points))
+    assert opened
+    assert len(os.listdir(tmp_path)) == len(points)
+
+    def open_none():
+        raise AssertionError("All the blocks are cached")
+
+    cache = BlockCache(tmp_path, size=len(data))
+    check_reads(BlockReader(open_none, cache, file_key(gz_path), points))
+
+
+def test_search_cached(gz_path, index_name, tmp_path, monkeypatch):
+    cache = BlockCache(tmp_path, size=10**7)
+    monkeypatch.setattr("tough.opener.get_block_cache", lambda: cache)
+    with gzip.open(gz_path, "rb") as f:
+        expected = f.readlines()[1500]
+
+    with fopen(gz_path, index_name, cached=True) as f:
+        f.seek(len(expected) * 1500)
+        assert f.readline() == expected
+
+    assert os.listdir(tmp_path)
+    with fopen(gz_path, index_name) as f:
+        assert not isinstance(f, BlockReader)
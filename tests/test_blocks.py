@@ -0,0 +1,54 @@
+import pytest
+
+from tough.blocks import BlockStore, exclude_ranges
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = BlockStore(str(tmp_path / "file.ngram"))
+    store.append(0, 10, b"first")
+    store.append(10, 20, b"second")
+    store.append(20, 25, b"third")
+    return store
+
+
+def test_block_store(store):
+    assert store.exists()
+    assert [x[1] for x in store.read(store.records())] == [
+        b"first",
+        b"second",
+        b"third",
+    ]
+    assert [x.line_from for x in store.records(10, 20)] == [10]
+    assert [x.line_from for x in store.records(9, 21)] == [0, 10, 20]
+
+
+def test_block_store_truncate(store):
+    store.truncate(15)
+    records = store.records()
+    assert [(x.line_from, x.line_to) for x in records] == [(0, 10), (10, 15)]
+
+    store.append(15, 30, b"new")
+    assert [x[1] for x in store.read(store.records(14))] == [b"second", b"new"]
+
+
+def test_block_store_reset(store):
+    store = BlockStore(store.fname, reset=True)
+    assert not store.exists()
+    assert store.records() == []
+    assert list(store.read(store.records())) == []
+    store.truncate(0)
+
+
+@pytest.mark.parametrize(
+    ("excluded", "ranges"),
+    [
+        ([], [(0, 100)]),
+        ([(0, 100)], []),
+        ([(10, 20), (20, 30)], [(0, 10), (30, 100)]),
+        ([(50, 150), (-10, 10)], [(10, 50)]),
+        ([(100, 120)], [(0, 100)]),
+    ],
+)
+def test_exclude_ranges(excluded, ranges):
+    assert exclude_ranges(0, 100, excluded) == ranges
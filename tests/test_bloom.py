@@ -0,0 +1,42 @@
+import re
+
+import pytest
+
+from tough.bloom import bloom_may_contain, encode_bloom, query_tokens
+
+
+def test_bloom():
+    bloom = encode_bloom(b"GET /api/users/42?trace=5f3e-77a1 HTTP/1.1\n")
+    assert bloom_may_contain(bloom, [b"users", b"42", b"5f3e", b"HTTP"])
+    assert not bloom_may_contain(bloom, [b"user"])
+    assert not bloom_may_contain(bloom, [b"POST"])
+    assert bloom_may_contain(bloom, [])
+
+
+def test_bloom_false_positives():
+    bloom = encode_bloom(b" ".join(b"token%d" % i for i in range(1000)))
+    assert len(bloom) < 1000 * 2
+    assert all(bloom_may_contain(bloom, [b"token%d" % i]) for i in range(1000))
+    false_positives = sum(
+        bloom_may_contain(bloom, [b"other%d" % i]) for i in range(1000)
+    )
+    assert false_positives < 30
+
+
+@pytest.mark.parametrize(
+    ("regex", "substring", "tokens"),
+    [
+        (None, b"trace=5f3e-77a1 ", [b"5f3e", b"77a1"]),
+        (None, b" 5f3e ", [b"5f3e"]),
+        (None, b"5f3e-77a1", []),
+        (rb"user=\d+ GET /api/", b"", [b"GET", b"api"]),
+        (rb"(?i) GET ", b"", []),
+        (rb"\b5f3e77a1\b", b"", [b"5f3e77a1"]),
+        (rb"(?<!\w)(?:5f3e\-77a1)(?!\w)", b"", [b"5f3e", b"77a1"]),
+        (rb"^GET\s", b"", [b"GET"]),
+        (rb"\b5f3e\d", b"", []),
+    ],
+)
+def test_query_tokens(regex, substring, tokens):
+    regex = regex and re.compile(regex)
+    assert query_tokens(regex, substring) == tokens
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from tough import INDEX_DEFAULTS, get_indexes, parse_indexes
+from tough.pool import create_pool
+
+INDEX_CONF = {
+    "base_dir": "/var/log/nginx",
+    "pattern": "access.log*",
+    "datetime_regex": r"\[([^\]]*)",
+    "datetime_format": "%d/%b/%Y:%H:%M:%S %z",
+}
+
+
+@pytest.fixture
+def conf_name(tmp_path):
+    conf = tmp_path / "conf.yaml"
+    conf.write_text(
+        "app:\n"
+        "  base_dir: /var/log\n"
+        "  pattern: app.log*\n"
+        "  datetime_regex: x\n"
+        "  datetime_format: y\n"
+    )
+    return str(conf)
+
+
+def test_get_indexes(conf_name):
+    indexes = get_indexes(conf_name)
+    assert list(indexes) == ["app"]
+    assert indexes["app"]["pattern"] == "app.log*"
+    assert indexes["app"]["date_granularity"] == "day"
+    assert get_indexes(conf_name) is indexes
+
+
+def test_get_indexes_reload(conf_name):
+    indexes = get_indexes(conf_name)
+    with open(conf_name, "a") as f:
+        f.write("  date_granularity: hour\n")
+
+    stat = os.stat(conf_name)
+    os.utime(conf_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert get_indexes(conf_name)["app"]["date_granularity"] == "hour"
+    assert indexes["app"]["date_granularity"] == "day"
+
+
+def test_get_indexes_missing(tmp_path):
+    assert get_indexes(str(tmp_path / "conf.yaml")) == {}
+
+
+def test_parse_indexes_defaults():
+    assert parse_indexes(None) == {}
+    assert parse_indexes({"app": INDEX_CONF}) == {
+        "app": {**INDEX_DEFAULTS, **INDEX_CONF}
+    }
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        ["app"],
+        {"app": "access.log"},
+        {"app": {"base_dir": "/var/log/nginx"}},
+        {"app": {**INDEX_CONF, "date_granularity": "second"}},
+        {"app": {**INDEX_CONF, "map_format": "json"}},
+        {"app": {**INDEX_CONF, "map_checkpoint_interval": 0}},
+        {"app": {**INDEX_CONF, "gzip_spacing": 32 * 1024}},
+    ],
+)
+def test_parse_indexes_fail(data):
+    with pytest.raises(ValueError):
+        parse_indexes(data)
+
+
+def test_create_pool(index_name):
+    with create_pool(2) as pool:
+        indexes = pool.apply(get_indexes)
+
+    assert indexes == get_indexes()
+    assert indexes[index_name]["map_format"] == "compact"
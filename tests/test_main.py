@@ -1,5 +1,9 @@
+import argparse
+
 import pytest
 
+from tough.tough import positive_int, run
+
 
 def test_main():
     import sys
@@ -9,3 +13,20 @@ def test_main():
         from tough import __main__
 
         _ = __main__
+
+
+def test_positive_int():
+    assert positive_int("3") == 3
+    for value in ("0", "-1"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
+
+@pytest.mark.parametrize(
+    "args, line",
+    [(["--stats"], "wall time: "), (["--stats-format", "json"], "{")],
+)
+def test_stats(index_name, capsys, monkeypatch, args, line):
+    monkeypatch.setattr("sys.argv", ["tough", "reindex", *args, index_name])
+    run()
+    assert capsys.readouterr().err.startswith(line)
@@ -0,0 +1,32 @@
+import re
+
+import pytest
+
+from tough.ngram import encode_ngrams, may_contain, query_literals
+
+
+def test_may_contain():
+    ngrams = encode_ngrams(b"GET /api/users/42 HTTP/1.1\n")
+    assert may_contain(ngrams, [b"users"])
+    assert may_contain(ngrams, [b"/api", b"HTTP"])
+    assert not may_contain(ngrams, [b"users/43"])
+    assert not may_contain(ngrams, [b"POST"])
+    assert may_contain(ngrams, [])
+
+
+@pytest.mark.parametrize(
+    ("regex", "substring", "literals"),
+    [
+        (None, b"request-id", [b"request-id"]),
+        (None, b"id", []),
+        (rb"user=\d+ GET /api", b"", [b"user=", b" GET /api"]),
+        (rb"(foo|bar)baz", b"", [b"baz"]),
+        (rb"(?:abc)+x?def", b"", [b"abc", b"def"]),
+        (rb"abc*d", b"", []),
+        (rb"(?i)abcd", b"", []),
+        (rb"(?i:abcd)efgh", b"", [b"efgh"]),
+    ],
+)
+def test_query_literals(regex, substring, literals):
+    regex = regex and re.compile(regex)
+    assert query_literals(regex, substring) == literals
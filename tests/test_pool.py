@@ -0,0 +1,61 @@
+import multiprocessing as mp
+import operator
+
+import pytest
+
+from tough.pool import Stream, create_pool, imap_bounded, imap_streamed
+
+
+def test_imap_bounded():
+    with mp.Pool(2) as pool:
+        result = imap_bounded(pool, operator.neg, range(10), 3)
+        assert list(result) == [-x for x in range(10)]
+
+
+def batches(n):
+    for i in range(n):
+        yield [n] * i
+
+
+def test_imap_streamed():
+    stream = Stream()
+    pool = create_pool(2, stream=stream)
+    result = list(imap_streamed(pool, stream, batches, [3, 0, 4], 2))
+
+    assert result == [
+        (3, []),
+        (3, [3]),
+        (3, [3, 3]),
+        (3, None),
+        (0, None),
+        (4, []),
+        (4, [4]),
+        (4, [4, 4]),
+        (4, [4, 4, 4]),
+        (4, None),
+    ]
+
+    # Cancel the run, the results left don't get into the next one
+    results = imap_streamed(pool, stream, batches, [1000, 1000, 1000], 2)
+    assert next(results) == (1000, [])
+    results.close()
+    result = list(imap_streamed(pool, stream, batches, [2], 2))
+    assert result == [(2, []), (2, [2]), (2, None)]
+
+    pool.close()
+    pool.join()
+
+
+def fail(n):
+    yield [n]
+    raise ValueError(n)
+
+
+def test_imap_streamed_fail():
+    stream = Stream()
+    pool = create_pool(2, stream=stream)
+    with pytest.raises(ValueError):
+        list(imap_streamed(pool, stream, fail, [1, 2], 2))
+
+    pool.close()
+    pool.join()
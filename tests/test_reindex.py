@@ -1,7 +1,15 @@
+import datetime
+import gzip
 import json
+import os
+import shutil
 
-from tough.commands.reindex import run_reindex
+from tough import get_indexes
+from tough.commands.reindex import indexer, run_reindex
 from tough.config import DATE_INDEX_NAME, INDEX_DIR
+from tough.date_index import DateIndex
+from tough.eol_mapper import EOLMapper, get_mapper, map_fname
+from tough.opener import gzindex_fname
 
 expected_index = {
     "2019-02-20": {"access_log.2.gz": [0, 9]},
@@ -13,23 +21,166 @@ expected_index = {
 
 def test_reindex_empty(index_name):
     run_reindex(index_name)
-    assert not (INDEX_DIR / index_name / DATE_INDEX_NAME).is_file()
+    assert DateIndex(index_name).bounds() is None
 
 
 def test_reindex_data(provide_data, index_name):
     run_reindex(index_name)
-    actual_index = json.load(open(INDEX_DIR / index_name / DATE_INDEX_NAME))
+    actual_index = DateIndex(index_name).to_dict()
     assert actual_index == expected_index
 
 
 def test_reindex_all(provide_data, index_name):
     run_reindex("")
-    actual_index = json.load(open(INDEX_DIR / index_name / DATE_INDEX_NAME))
+    actual_index = DateIndex(index_name).to_dict()
     assert actual_index == expected_index
 
 
 def test_reindex_twice(provide_data, index_name):
     run_reindex("")
     run_reindex("")
-    actual_index = json.load(open(INDEX_DIR / index_name / DATE_INDEX_NAME))
+    actual_index = DateIndex(index_name).to_dict()
     assert actual_index == expected_index
+
+
+def test_reindex_append(provide_data, data_dir, get_row, index_name):
+    run_reindex(index_name)
+    with open(data_dir / index_name / index_name, "a") as f:
+        f.writelines(get_row(datetime.date(2019, 2, 24)) for _ in range(5))
+
+    run_reindex(index_name)
+    actual_index = DateIndex(index_name).to_dict()
+    assert actual_index == {
+        **expected_index,
+        "2019-02-24": {"access_log": [110, 114]},
+    }
+    assert get_mapper(index_name, index_name).count_lines() == 115
+
+
+def test_reindex_partial_line(data_dir, get_row, index_name):
+    row = get_row(datetime.date(2019, 2, 20))
+    path = data_dir / index_name / index_name
+    path.write_text(row + row[:50])
+    run_reindex(index_name)
+    assert get_mapper(index_name, index_name).count_lines() == 2
+
+    with open(path, "a") as f:
+        f.write(row[50:] + row)
+
+    run_reindex(index_name)
+    actual_index = DateIndex(index_name).to_dict()
+    assert actual_index == {"2019-02-20": {"access_log": [0, 2]}}
+    mapper = get_mapper(index_name, index_name)
+    assert mapper.count_lines() == 3
+    assert mapper.read(1).length == len(row) - 1
+
+
+def test_reindex_truncated(provide_data, create_data_file, index_name):
+    run_reindex(index_name)
+    create_data_file(index_name, ((datetime.date(2019, 2, 22), 5),))
+
+    run_reindex(index_name)
+    actual_index = DateIndex(index_name).to_dict()
+    assert actual_index["2019-02-22"]["access_log"] == [0, 4]
+    assert "2019-02-23" not in actual_index
+    assert get_mapper(index_name, index_name).count_lines() == 5
+
+
+def test_reindex_rotated(provide_data, data_dir, create_data_file, index_name):
+    run_reindex(index_name)
+    files_dir = data_dir / index_name
+    map_ino = os.stat(map_fname(f"{index_name}.1", index_name)).st_ino
+
+    # logrotate with compress: log.2.gz is gone, log.1 becomes log.2.gz,
+    # log becomes log.1 and a new log is started
+    with open(files_dir / f"{index_name}.1", "rb") as src:
+        with gzip.open(files_dir / f"{index_name}.2.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+    os.remove(files_dir / f"{index_name}.1")
+    os.rename(files_dir / index_name, files_dir / f"{index_name}.1")
+    create_data_file(index_name, ((datetime.date(2019, 2, 24), 5),))
+
+    run_reindex(index_name)
+    actual_index = DateIndex(index_name).to_dict()
+    assert actual_index == {
+        "2019-02-21": {"access_log.2.gz": [0, 9]},
+        "2019-02-22": {"access_log.2.gz": [10, 109], "access_log.1": [0, 9]},
+        "2019-02-23": {"access_log.1": [10, 109]},
+        "2019-02-24": {"access_log": [0, 4]},
+    }
+    assert os.stat(map_fname(f"{index_name}.2.gz", index_name)).st_ino == (
+        map_ino
+    )
+    assert get_mapper(f"{index_name}.2.gz", index_name).count_lines() == 110
+    assert os.path.isfile(gzindex_fname(f"{index_name}.2.gz", index_name))
+
+
+def test_reindex_granularity(data_dir, get_row, index_name, monkeypatch):
+    index_conf = {**get_indexes()[index_name], "date_granularity": "minute"}
+    monkeypatch.setattr(
+        "tough.commands.reindex.get_indexes",
+        lambda: {index_name: index_conf},
+    )
+    date = datetime.date(2019, 2, 20)
+    times = ["12:00:00", "12:00:59", "12:01:00", "13:00:01", "13:00:02"]
+    (data_dir / index_name / index_name).write_text(
+        "".join(get_row(date, time) for time in times)
+    )
+
+    run_reindex(index_name)
+    actual_index = DateIndex(index_name).to_dict()
+    assert actual_index == {
+        "2019-02-20T12:00": {"access_log": [0, 1]},
+        "2019-02-20T12:01": {"access_log": [2]},
+        "2019-02-20T13:00": {"access_log": [3, 4]},
+    }
+
+
+def test_reindex_granularity_changed(provide_data, index_name, monkeypatch):
+    run_reindex(index_name)
+    assert DateIndex(index_name).granularity() == "day"
+
+    index_conf = {**get_indexes()[index_name], "date_granularity": "hour"}
+    monkeypatch.setattr(
+        "tough.commands.reindex.get_indexes",
+        lambda: {index_name: index_conf},
+    )
+    run_reindex(index_name)
+    date_index = DateIndex(index_name)
+    assert date_index.granularity() == "hour"
+    assert date_index.to_dict() == {
+        f"{day}T12": files for day, files in expected_index.items()
+    }
+
+
+def test_reindex_json_date_index(provide_data, index_name):
+    run_reindex(index_name)
+    date_index = DateIndex(index_name)
+    date_index.conn.execute("DELETE FROM date_index")
+    date_index.commit()
+    with open(INDEX_DIR / index_name / DATE_INDEX_NAME, "w") as f:
+        json.dump(expected_index, f)
+
+    assert DateIndex(index_name).to_dict() == expected_index
+    assert not (INDEX_DIR / index_name / DATE_INDEX_NAME).is_file()
+
+
+def test_indexer(get_row, index_name):
+    rows = [
+        get_row(datetime.date(2019, 2, 20)),
+        get_row(datetime.date(2019, 2, 20)),
+        get_row(datetime.date(2019, 2, 21)),
+    ]
+    block, spans, ngrams, blooms = indexer(
+        ("".join(rows).encode(), 100), index_name, EOLMapper
+    )
+    assert ngrams == []
+    assert blooms == []
+    assert spans == [["2019-02-20", 2], ["2019-02-21", 1]]
+    assert block.start == 100
+    assert list(block.offsets) == [
+        100 + len(rows[0]),
+        100 + len(rows[0]) * 2,
+        100 + len(rows[0]) * 3,
+    ]
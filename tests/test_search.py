@@ -1,9 +1,28 @@
 import datetime
+from functools import partial
+import os
+import re
 
 import pytest
 
+from tough import get_indexes
 from tough.commands.reindex import run_reindex
-from tough.commands.search import run_search
+from tough.commands.search import (
+    filter_lines,
+    find_lines,
+    follow_step,
+    get_chunk_key,
+    get_index_chunks,
+    get_matcher,
+    get_query,
+    largest_first,
+    run_search,
+    search_chunk,
+    searcher,
+)
+from tough.eol_mapper import get_cost, get_mapper
+from tough.file_index import FileIndex
+from tough.pool import Stream, create_pool
 
 
 @pytest.mark.parametrize(
@@ -55,7 +74,469 @@ def test_search_wrong_index(create_data_file, capsys, index_name, search_date):
     assert len([*filter(None, captured.out.split("\n"))]) == 1
 
 
+def test_search_chunk_boundary(create_data_file, capsys, index_name):
+    # The date range length is a multiple of MIN_CHUNK_LENGTH
+    create_data_file(index_name, ((datetime.date(2019, 2, 20), 9),))
+    run_reindex(index_name)
+    run_search("HTTP", None, index_name, "2019-02-20", "2019-02-20")
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == 9
+
+
+@pytest.mark.parametrize(
+    ("date_from", "date_to", "count"),
+    [
+        ("2019-02-21T12:00", "2019-02-21T13", 110),
+        ("2019-02-20T12:35", "2019-02-21", 110),
+        ("2019-02-20T12:34:56", "2019-02-20T12:34:56", 10),
+        ("2019-02-22 12:35:00", "2019-02-23 12:34:56", 100),
+        ("2019-02-23T12:34:57", "2019-02-23T23:59", 0),
+        (None, "2019-02-20T13", 10),
+        ("2019-02-23T12:34:00", None, 100),
+    ],
+)
+def test_search_timestamps(
+    provide_data, capsys, date_from, date_to, count, index_name
+):
+    run_reindex(index_name)
+    run_search("HTTP", None, index_name, date_from, date_to)
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == count
+
+
+@pytest.mark.parametrize("limit", [1, 15, 330, 1000])
+def test_search_limit(provide_data, capsys, index_name, limit):
+    run_reindex(index_name)
+    run_search("HTTP/1.1", None, index_name, limit=limit)
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == min(limit, 330)
+
+
+@pytest.mark.parametrize(
+    ("date_from", "limit", "count"),
+    [(None, None, 330), ("2019-02-21", None, 110), (None, 15, 15)],
+)
+def test_search_count_only(
+    provide_data, capsys, index_name, date_from, limit, count
+):
+    run_reindex(index_name)
+    run_search("HTTP/1.1", None, index_name, date_from, date_from, limit, True)
+    captured = capsys.readouterr()
+    assert captured.out == f"{count}\n"
+
+
+@pytest.mark.parametrize(
+    ("regex", "count_by", "expected"),
+    [
+        (
+            None,
+            ["day"],
+            "2019-02-20\t10\n2019-02-21\t110\n"
+            "2019-02-22\t110\n2019-02-23\t100\n",
+        ),
+        (
+            None,
+            ["file", "hour"],
+            "access_log\t2019-02-22T12\t10\n"
+            "access_log\t2019-02-23T12\t100\n"
+            "access_log.1\t2019-02-21T12\t10\n"
+            "access_log.1\t2019-02-22T12\t100\n"
+            "access_log.2.gz\t2019-02-20T12\t10\n"
+            "access_log.2.gz\t2019-02-21T12\t100\n",
+        ),
+        (r"\] \"(\w+) .* (\d+) \d+ ", ["group"], "GET\t404\t330\n"),
+    ],
+)
+def test_search_count_by(
+    provide_data, capsys, index_name, regex, count_by, expected
+):
+    run_reindex(index_name)
+    run_search("HTTP", regex, index_name, count_by=count_by)
+    captured = capsys.readouterr()
+    assert captured.out == expected
+
+
+@pytest.mark.parametrize(
+    ("count_by", "limit", "error"),
+    [
+        (
+            ["week"],
+            None,
+            "Wrong --count-by: week, "
+            "should be day, hour, minute, index, file, group\n",
+        ),
+        (["group"], None, "Counting by group requires --regex (-e)\n"),
+        (["day"], 10, "--limit (-n) can't be used with --count-by\n"),
+    ],
+)
+def test_search_count_by_fail(capsys, count_by, limit, error):
+    run_search("HTTP", None, "", limit=limit, count_by=count_by)
+    captured = capsys.readouterr()
+    assert captured.err == error
+
+
+def test_search_granularity_changed(
+    provide_data, capsys, index_name, monkeypatch
+):
+    run_reindex(index_name)
+    index_conf = {**get_indexes()[index_name], "date_granularity": "hour"}
+    monkeypatch.setattr(
+        "tough.commands.search.get_indexes",
+        lambda: {index_name: index_conf},
+    )
+    run_search("HTTP", None, index_name, "2019-02-21")
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err == (
+        f"Date index of {index_name} is by day, "
+        f"reindex it after changing date_granularity\n"
+    )
+
+
+@pytest.mark.parametrize("buf_size", [100, 1024 * 1024])
+def test_search_reverse(
+    provide_data, capsys, index_name, monkeypatch, buf_size
+):
+    run_reindex(index_name)
+    monkeypatch.setattr("tough.commands.search.SEARCH_BUF_SIZE", buf_size)
+    run_search("HTTP", None, index_name, "2019-02-20", "2019-02-23")
+    lines = capsys.readouterr().out.splitlines()
+    run_search("HTTP", None, index_name, reverse=True)
+    assert capsys.readouterr().out.splitlines() == lines[::-1]
+    assert len(lines) == 330
+
+
+def test_search_follow(create_data_file, capsys, data_dir, get_row, index_name):
+    date = datetime.date(2019, 2, 20)
+    path = data_dir / index_name / index_name
+    create_data_file(index_name, ((date, 10),))
+    run_reindex(index_name)
+    states = FileIndex(index_name).files
+    index_conf = get_indexes()[index_name]
+    func = partial(
+        search_chunk, regex=None, substring=b"POST", index_name=index_name
+    )
+    stream = Stream()
+    pool = create_pool(2, stream=stream)
+    follow = partial(follow_step, index_name, index_conf, pool, stream, func)
+
+    row = get_row(date).replace("GET", "POST")
+    with open(path, "a") as f:
+        f.write(row * 2)
+
+    states = follow(states)
+    assert capsys.readouterr().out == row * 2
+    states = follow(states)
+    assert capsys.readouterr().out == ""
+
+    # Rotation: the rest of the renamed file and the new file are searched
+    with open(path, "a") as f:
+        f.write(row)
+
+    os.rename(path, f"{path}.1")
+    with open(path, "w") as f:
+        f.write(get_row(date) + row)
+
+    follow(states)
+    assert capsys.readouterr().out == row * 2
+    pool.close()
+    pool.join()
+
+
 def test_search_fail(capsys):
     run_search("", "", "")
     captured = capsys.readouterr()
     assert "Please" in captured.err
+
+
+@pytest.mark.parametrize("sort", [False, True])
+@pytest.mark.parametrize("limit", [0, -1])
+def test_search_wrong_limit(provide_data, capsys, index_name, limit, sort):
+    run_reindex(index_name)
+    capsys.readouterr()
+    run_search("HTTP", None, index_name, limit=limit, sort=sort)
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err == "--limit (-n) should be 1 or more\n"
+
+
+@pytest.mark.parametrize(
+    ("substring", "regex", "lines"),
+    [
+        (b"baz", None, [(4, 12), (12, 16)]),
+        (b"o\n", None, [(0, 4)]),
+        (b"o\nb", None, []),
+        (b"", rb"^ba", [(4, 12), (12, 16)]),
+        (b"", rb"o$", [(0, 4)]),
+        (b"", rb"o\s+", [(0, 4)]),
+        (b"", rb"x*", [(0, 4), (4, 12), (12, 16)]),
+    ],
+)
+def test_find_lines(substring, regex, lines):
+    buf = b"foo\nbar baz\nbaz\n"
+    find, check = get_matcher(regex and re.compile(regex), substring)
+    assert list(find_lines(buf, find, check)) == lines
+
+
+def test_searcher_blocks(provide_data, index_name, data_dir, monkeypatch):
+    run_reindex(index_name)
+    monkeypatch.setattr("tough.commands.search.SEARCH_BUF_SIZE", 100)
+    path = data_dir / index_name / index_name
+    chunk = (str(path), 5, 100, 50)
+    _, results = searcher(chunk, None, b"HTTP", index_name)
+
+    lines = path.read_bytes().splitlines(keepends=True)
+    offsets = [sum(map(len, lines[:i])) for i in range(5, 50)]
+    assert results == [
+        (i, offset, lines[i].strip())
+        for i, offset in zip(range(5, 50), offsets)
+    ]
+
+
+def test_search_ngram_index(
+    provide_data, capsys, data_dir, get_row, index_name, monkeypatch
+):
+    index_conf = {
+        **get_indexes()[index_name],
+        "ngram_index": True,
+        "ngram_block_lines": 10,
+    }
+    for module in ("reindex", "search"):
+        monkeypatch.setattr(
+            f"tough.commands.{module}.get_indexes",
+            lambda: {index_name: index_conf},
+        )
+
+    path = data_dir / index_name / index_name
+    run_reindex(index_name)
+    # Read as one buffer, which is split into blocks of lines
+    with open(path, "a") as f:
+        f.write(get_row(datetime.date(2019, 2, 23)).replace("GET", "POST"))
+        f.writelines(get_row(datetime.date(2019, 2, 24)) for _ in range(15))
+
+    run_reindex(index_name)
+    assert filter_lines(str(path), index_name, 0, 126, [b"POST"]) == [
+        (110, 120)
+    ]
+
+    run_search("POST", None, index_name)
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == 1
+
+    run_search("", r"HTTP/1\.1.*404", index_name, "2019-02-23", "2019-02-23")
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == 101
+
+
+def test_search_bloom_index(
+    create_data_file, capsys, data_dir, get_row, index_name, monkeypatch
+):
+    index_conf = {
+        **get_indexes()[index_name],
+        "bloom_index": True,
+        "bloom_block_lines": 10,
+    }
+    for module in ("reindex", "search"):
+        monkeypatch.setattr(
+            f"tough.commands.{module}.get_indexes",
+            lambda: {index_name: index_conf},
+        )
+
+    date = datetime.date(2019, 2, 20)
+    create_data_file(index_name, ((date, 50),))
+    path = data_dir / index_name / index_name
+    with open(path, "a") as f:
+        f.write(get_row(date).replace("GET", "POST"))
+
+    run_reindex(index_name)
+    # Blocks of other lines may give false positives, but not all of them
+    lines_ranges = filter_lines(str(path), index_name, 0, 51, None, [b"POST"])
+    assert lines_ranges[-1] == (50, 51)
+    assert sum(hi - lo for lo, hi in lines_ranges) < 51
+
+    run_search('"POST /', None, index_name)
+    captured = capsys.readouterr()
+    assert len([*filter(None, captured.out.split("\n"))]) == 1
+
+
+def test_search_bloom_word(
+    create_data_file, capsys, data_dir, get_row, index_name, monkeypatch
+):
+    index_conf = {
+        **get_indexes()[index_name],
+        "bloom_index": True,
+        "bloom_block_lines": 10,
+    }
+    for module in ("reindex", "search"):
+        monkeypatch.setattr(
+            f"tough.commands.{module}.get_indexes",
+            lambda: {index_name: index_conf},
+        )
+
+    date = datetime.date(2019, 2, 20)
+    create_data_file(index_name, ((date, 50),))
+    path = data_dir / index_name / index_name
+    with open(path, "a") as f:
+        f.write(get_row(date).replace("GET /", "GET /5f3e77a1/"))
+
+    run_reindex(index_name)
+    # A bare ID is a whole token only when matching whole words
+    query = get_query("5f3e77a1", None, index_name, index_conf, word=True)
+    assert query["tokens"] == [b"5f3e77a1"]
+    lines_ranges = filter_lines(
+        str(path), index_name, 0, 51, None, query["tokens"]
+    )
+    assert sum(hi - lo for lo, hi in lines_ranges) < 51
+
+    for substring, word, count in [
+        ("5f3e77a1", True, 1),
+        ("5f3e77a", True, 0),
+        ("5f3e77a", False, 1),
+    ]:
+        run_search(substring, None, index_name, word=word)
+        assert len(capsys.readouterr().out.splitlines()) == count
+
+
+@pytest.fixture
+def provide_other_data(get_row, data_dir, other_index_name):
+    rows = [
+        *(get_row(datetime.date(2019, 2, 21), "08:00:00") for _ in range(5)),
+        *(get_row(datetime.date(2019, 2, 22), "13:00:00") for _ in range(5)),
+    ]
+    path = data_dir / other_index_name / other_index_name
+    path.write_text("".join(rows))
+    return rows
+
+
+@pytest.mark.parametrize(
+    ("index", "date_from", "count"),
+    [
+        ("access_log,other_log", None, 340),
+        ("*_log", "2019-02-21T09", 325),
+        ("other_*", None, 10),
+    ],
+)
+def test_search_indexes(
+    provide_data, provide_other_data, capsys, index, date_from, count
+):
+    run_reindex()
+    capsys.readouterr()
+    run_search("HTTP/1.1", None, index, date_from=date_from)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == count
+
+
+def test_index_chunks(provide_data, provide_other_data):
+    run_reindex()
+    items = get_index_chunks(["access_log", "other_log"])
+    # Split by cost, not by the two hours the lines of other_log are in
+    assert [x[1][1:] for x in items if x[0] == "other_log"] == [(0, 10, 10)]
+    assert len(items) < 20
+
+    keys = [get_chunk_key(*x) for x in items]
+    assert keys == sorted(keys)
+    assert get_index_chunks(["access_log", "other_log"], reverse=True) == (
+        items[::-1]
+    )
+
+
+def test_search_indexes_overlap(
+    provide_other_data, capsys, data_dir, get_row, index_name
+):
+    # Logged when done, with the time the request started at: ranges of
+    # the two days overlap in the date index
+    day, next_day = datetime.date(2019, 2, 20), datetime.date(2019, 2, 21)
+    rows = [
+        get_row(day, "23:59:58"),
+        get_row(next_day, "00:00:01"),
+        get_row(day, "23:59:59"),
+        get_row(next_day, "00:00:02"),
+    ]
+    (data_dir / index_name / index_name).write_text("".join(rows))
+    run_reindex()
+    capsys.readouterr()
+
+    run_search("HTTP/1.1", None, "access_log,other_log")
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == sorted(x.strip() for x in rows + provide_other_data)
+
+    run_search("HTTP/1.1", None, "access_log,other_log", count_by=["index"])
+    assert capsys.readouterr().out == "access_log\t4\nother_log\t10\n"
+
+
+def test_search_indexes_count_by(provide_data, provide_other_data, capsys):
+    run_reindex()
+    capsys.readouterr()
+    run_search("HTTP/1.1", None, "access_log,other_log", count_by=["index"])
+    assert capsys.readouterr().out == "access_log\t330\nother_log\t10\n"
+
+    run_search("HTTP/1.1", None, "missing_*", count_only=True)
+    assert capsys.readouterr().err == "No index matches missing_*\n"
+
+    run_search("HTTP/1.1", None, "access_log,missing", count_only=True)
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err == "No index matches missing\n"
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_search_sort(
+    provide_data, provide_other_data, capsys, data_dir, get_row, reverse
+):
+    # Rotated files with interleaving timestamps
+    date = datetime.date(2019, 2, 24)
+    for name, hours in (("access_log.3", (1, 3, 5)), ("access_log.4", (2, 4))):
+        path = data_dir / "access_log" / name
+        path.write_text("".join(get_row(date, f"{x:02}:00:00") for x in hours))
+
+    # Out of order across a day boundary, so that the ranges of the two
+    # days overlap in the date index
+    day, next_day = datetime.date(2019, 2, 18), datetime.date(2019, 2, 19)
+    rows = [
+        get_row(day, "23:59:58"),
+        get_row(next_day, "00:00:01"),
+        get_row(day, "23:59:59"),
+        get_row(next_day, "00:00:02"),
+    ]
+    (data_dir / "access_log" / "access_log.5").write_text("".join(rows))
+    rows = [x.strip() for x in rows]
+
+    run_reindex()
+    capsys.readouterr()
+    run_search("HTTP/1.1", None, "*_log", sort=True, reverse=reverse)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == len(set(lines)) == 349
+    # Lines of a file keep their order
+    first = lines[-4:][::-1] if reverse else lines[:4]
+    assert first == rows
+
+    timestamps = [
+        datetime.datetime.strptime(
+            re.search(r"\[([^\]]*)", x).group(1), "%d/%b/%Y:%H:%M:%S %z"
+        )
+        for x in lines
+        if x not in rows
+    ]
+    assert timestamps == sorted(timestamps, reverse=reverse)
+
+    # The files are merged line by line on the last day
+    hours = [re.search(r":(\d\d):", x).group(1) for x in lines]
+    last_day = hours[:5] if reverse else hours[-5:]
+    assert last_day == sorted(["01", "02", "03", "04", "05"], reverse=reverse)
+
+    run_search("HTTP/1.1", None, "*_log", limit=3, sort=True, reverse=reverse)
+    assert capsys.readouterr().out.splitlines() == lines[:3]
+
+
+def test_largest_first(provide_data, index_name):
+    run_reindex(index_name)
+    items = get_index_chunks([index_name], "2019-02-20", "2019-02-23")
+    costs = [
+        get_cost(path, get_mapper(path, index_name), start, start + length)
+        for _, (path, start, length, _) in largest_first(items)
+    ]
+    assert len(costs) == len(items) > 1
+    assert costs == sorted(costs, reverse=True)
+    # access_log.2.gz has no seek points to split it at, and costs more
+    # per byte than the plain files
+    assert largest_first(items)[0][1][0].endswith(".gz")
@@ -0,0 +1,85 @@
+import os
+import threading
+
+import pytest
+
+from tough.commands.reindex import run_reindex
+from tough.commands.search import run_search
+from tough.commands.serve import SearchServer, connect, run_client_search
+from tough.opener import fopen, keep_files
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = SearchServer(str(tmp_path / "tough.sock"))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        dict(substring="HTTP/1.1"),
+        dict(substring="HTTP/1.1", limit=5),
+        dict(substring="HTTP/1.1", date_from="2019-02-21", count_only=True),
+        dict(substring="", regex=r"\[(\d+)/", count_by=["day", "group"]),
+    ],
+)
+def test_serve(provide_data, capsys, index_name, server, kwargs):
+    kwargs = {"regex": None, "index": index_name, **kwargs}
+    run_reindex(index_name)
+    capsys.readouterr()
+
+    run_search(**kwargs)
+    expected = capsys.readouterr().out
+    assert expected
+
+    for _ in range(2):
+        run_client_search(server.server_address, **kwargs)
+        assert capsys.readouterr().out == expected
+
+
+def test_serve_error(capsys, server, index_name):
+    run_client_search(
+        server.server_address, substring="", regex="(", index=index_name
+    )
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "error: missing )" in captured.err
+
+
+def test_client_without_server(tmp_path, provide_data, capsys, index_name):
+    socket_name = str(tmp_path / "tough.sock")
+    assert connect(socket_name) is None
+
+    run_reindex(index_name)
+    run_client_search(socket_name, substring="", regex=None, index=index_name)
+    assert "Please provide substring" in capsys.readouterr().err
+
+
+def test_keep_files(provide_data, data_dir, index_name):
+    run_reindex(index_name)
+    path = str(data_dir / index_name / f"{index_name}.2.gz")
+    keep_files(1)
+    try:
+        with fopen(path, index_name) as f:
+            line = f.readline()
+
+        with fopen(path, index_name) as kept:
+            assert kept is f
+            kept.seek(0)
+            assert kept.readline() == line
+
+        os.utime(path, ns=(0, 0))
+        with fopen(path, index_name) as reopened:
+            assert reopened is not f
+
+        assert f.closed
+    finally:
+        keep_files(0)
+
+    assert reopened.closed
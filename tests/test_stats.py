@@ -0,0 +1,75 @@
+import json
+
+from tough import stats
+from tough.commands.reindex import run_reindex
+from tough.commands.search import run_search
+
+
+def test_disabled():
+    with stats.timer("x"):
+        stats.count("y")
+
+    assert list(stats.timed("z", [1, 2])) == [1, 2]
+    assert not stats.enabled()
+    assert not stats._timers and not stats._counters
+
+
+def test_report(provide_data, index_name, capsys, tmp_path):
+    stats.enable(str(tmp_path))
+    try:
+        run_reindex(index_name)
+        run_search("HTTP/1.1", None, index_name, date_from="2019-02-21")
+    finally:
+        stats.report("json", 1.5)
+        stats._timers.clear()
+        stats._counters.clear()
+
+    data = json.loads(capsys.readouterr().err.splitlines()[-1])
+    assert data["wall"] == 1.5
+    assert data["main"]["counters"]["output.matches"] == 320
+    assert data["main"]["counters"]["reindex.bytes_read"] > 0
+    assert data["main"]["counters"]["date_index.ranges"] == 5
+    assert "pool.wait" in data["main"]["timers"]
+
+    workers = data["workers"]
+    assert workers["processes"] == 4
+    assert workers["counters"]["reindex.lines"] == 330
+    assert workers["counters"]["search.matches"] == 320
+    assert workers["counters"]["search.lines"] == 320
+    assert "search.read" in workers["timers"]
+    assert len(list(tmp_path.glob("worker-*.prof"))) == 4
+    assert not stats.enabled()
+
+
+def test_report_date_index(provide_data, index_name, capsys):
+    run_reindex(index_name)
+    stats.enable()
+    try:
+        run_search("HTTP/1.1", None, index_name, date_from="2019-02-21T13")
+    finally:
+        stats.report("json", 1.5)
+        stats._timers.clear()
+        stats._counters.clear()
+
+    counters = json.loads(capsys.readouterr().err.splitlines()[-1])["main"][
+        "counters"
+    ]
+    assert counters["output.matches"] == 210
+    assert counters["date_index.ranges"] == 3
+    assert counters["date_index.skipped_ranges"] == 2
+    assert counters["date_index.skipped_lines"] == 110
+
+
+def test_report_text(capsys):
+    stats.enable()
+    stats.count("search.matches", 3)
+    with stats.timer("search.scan"):
+        pass
+
+    stats.report()
+    stats._timers.clear()
+    stats._counters.clear()
+
+    err = capsys.readouterr().err
+    assert "main:" in err
+    assert "search.matches" in err and "search.scan" in err
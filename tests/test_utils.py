@@ -1,6 +1,14 @@
+from datetime import datetime, timedelta, timezone
+
 import pytest
 
-from tough.utils import date_range, get_datetime
+from tough.utils import (
+    DatetimeExtractor,
+    date_range,
+    get_datetime,
+    parse_clf,
+    parse_date_arg,
+)
 
 
 def test_date_range():
@@ -8,6 +16,30 @@ def test_date_range():
     assert list(r) == ["2017-12-31", "2018-01-01", "2018-01-02"]
 
 
+def test_date_range_granularity():
+    r = date_range("2017-12-31 23:10", "2018-01-01T01", "hour")
+    assert list(r) == ["2017-12-31T23", "2018-01-01T00", "2018-01-01T01"]
+
+    r = date_range("2018-01-01T00:59:30", "2018-01-01T01:01", "minute")
+    assert list(r) == [
+        "2018-01-01T00:59",
+        "2018-01-01T01:00",
+        "2018-01-01T01:01",
+    ]
+
+
+def test_parse_date_arg():
+    dt, precision = parse_date_arg("2019-02-20T12:10")
+    assert dt == datetime(2019, 2, 20, 12, 10, tzinfo=timezone.utc)
+    assert precision == timedelta(minutes=1)
+
+    dt, _ = parse_date_arg("2019-02-20 12:10+0300", end=True)
+    assert dt == datetime(2019, 2, 20, 9, 10, 59, 999999, tzinfo=timezone.utc)
+
+    with pytest.raises(ValueError):
+        parse_date_arg("20/Feb/2019")
+
+
 def test_get_datetime(index_name):
     s = b'127.0.0.1 - - [20/Feb/2019:23:03:24 +0000] "GET / HTTP/1.1"'
     assert get_datetime(s, index_name) == "2019-02-20"
@@ -19,3 +51,54 @@ def test_get_datetime(index_name):
     s = b""
     with pytest.raises(ValueError):
         get_datetime(s, index_name)
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "20/Feb/2019:23:03:24 +0000",
+        "20/Feb/2019:23:03:24 +0300",
+        "31/Dec/2019:23:59:59 -0930",
+        "01/Jan/2020:00:00:00 +1400",
+    ],
+)
+def test_extractor_fast_path(timestamp):
+    fmt = "%d/%b/%Y:%H:%M:%S %z"
+    row = f"127.0.0.1 - - [{timestamp}] x".encode()
+    expected = datetime.strptime(timestamp, fmt).astimezone(timezone.utc)
+
+    extractor = DatetimeExtractor(r"\[([^\]]*)", fmt, "minute")
+    assert extractor.parse_fast is parse_clf
+    assert extractor.parse(row) == expected
+    assert extractor.bucket(row) == expected.strftime("%Y-%m-%dT%H:%M")
+
+
+@pytest.mark.parametrize(
+    ("timestamp", "bucket"),
+    [
+        ("20/feb/2019:23:03:24 +0000", "2019-02-20T23:03"),
+        ("20/Feb/2019:23:03:24 +03:00", "2019-02-20T20:03"),
+        ("20/FEB/2019:23:03:24 -01:30", "2019-02-21T00:33"),
+    ],
+)
+def test_extractor_fallback(timestamp, bucket):
+    fmt = "%d/%b/%Y:%H:%M:%S %z"
+    row = f"127.0.0.1 - - [{timestamp}] x".encode()
+    expected = datetime.strptime(timestamp, fmt).astimezone(timezone.utc)
+
+    extractor = DatetimeExtractor(r"\[([^\]]*)", fmt, "minute")
+    assert extractor.parse(row) == expected
+    assert extractor.bucket(row) == bucket
+
+
+def test_extractor_memo():
+    extractor = DatetimeExtractor(r"\[([^\]]*)", "%d/%b/%Y:%H:%M:%S %z")
+    assert extractor.bucket(b"[20/Feb/2019:23:59:58 +0000]") == "2019-02-20"
+    assert extractor.bucket(b"[20/Feb/2019:23:59:59 +0000]") == "2019-02-20"
+    assert extractor.bucket(b"[20/Feb/2019:23:59:59 -0100]") == "2019-02-21"
+    # Not memoized by the minute when laid out differently
+    assert extractor.bucket(b"[20/Feb/2019:23:59:59 -01:00]") == "2019-02-21"
+    assert extractor.bucket(b"[20/Feb/2019:23:59:59 +00:00]") == "2019-02-20"
+
+    with pytest.raises(ValueError):
+        extractor.bucket(b"[20/Foo/2019:23:59:59 +0000]")
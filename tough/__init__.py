@@ -1,10 +1,128 @@
+import os
+
 import yaml
 
 from .config import CONF_NAME
 
+REQUIRED_KEYS = ("base_dir", "pattern", "datetime_regex", "datetime_format")
+
+# Defaults of the optional per-index settings
+INDEX_DEFAULTS = {
+    "date_granularity": "day",
+    "map_format": "compact",
+    "map_checkpoint_interval": 64,
+    "ngram_index": False,
+    "ngram_block_lines": 1000,
+    "bloom_index": False,
+    "bloom_block_lines": 1000,
+    # Uncompressed bytes between seek points of gzip indexes
+    "gzip_spacing": 1024 * 1024,
+}
+
+CHOICES = {
+    "date_granularity": ("day", "hour", "minute"),
+    "map_format": ("compact", "fixed"),
+}
+
+POSITIVE_INTS = (
+    "map_checkpoint_interval",
+    "ngram_block_lines",
+    "bloom_block_lines",
+    "gzip_spacing",
+)
+
+# Seek points of gzip indexes must be further apart than the zlib window
+GZIP_WINDOW_SIZE = 32 * 1024
+
+# Config name -> (mtime, parsed indexes)
+_loaded = {}
+
 
 def get_indexes(conf_name=CONF_NAME):
+    """
+    Get the parsed and validated indexes config.
+
+    The YAML is parsed once and then again only when its mtime changes,
+    so that hot paths (e.g. pool workers) can call it for every task.
+    The returned dicts are shared and must not be modified.
+    """
     try:
-        return yaml.safe_load(open(CONF_NAME))
+        mtime = os.stat(conf_name).st_mtime_ns
     except FileNotFoundError:
         return {}
+
+    loaded = _loaded.get(conf_name)
+    if loaded is None or loaded[0] != mtime:
+        with open(conf_name) as f:
+            loaded = (mtime, parse_indexes(yaml.safe_load(f)))
+
+        _loaded[conf_name] = loaded
+
+    return loaded[1]
+
+
+def parse_indexes(data):
+    """
+    Validate indexes config and fill in the defaults.
+    """
+    if not data:
+        return {}
+
+    if not isinstance(data, dict):
+        raise ValueError("Config must be a mapping of index names")
+
+    indexes = {}
+    for index_name, index_conf in data.items():
+        if not isinstance(index_conf, dict):
+            raise ValueError(f"Index {index_name}: settings must be a mapping")
+
+        missing = [k for k in REQUIRED_KEYS if k not in index_conf]
+        if missing:
+            raise ValueError(
+                f"Index {index_name}: missing {', '.join(missing)}"
+            )
+
+        index_conf = {**INDEX_DEFAULTS, **index_conf}
+        for key, choices in CHOICES.items():
+            if index_conf[key] not in choices:
+                raise ValueError(
+                    f"Index {index_name}: {key} must be one of "
+                    f"{', '.join(choices)}"
+                )
+
+        for key in POSITIVE_INTS:
+            value = index_conf[key]
+            if not isinstance(value, int) or value < 1:
+                raise ValueError(
+                    f"Index {index_name}: {key} must be a positive integer"
+                )
+
+        if index_conf["gzip_spacing"] <= GZIP_WINDOW_SIZE:
+            raise ValueError(
+                f"Index {index_name}: gzip_spacing must be greater than "
+                f"{GZIP_WINDOW_SIZE}"
+            )
+
+        indexes[index_name] = index_conf
+
+    return indexes
+
+
+def get_config_snapshot(conf_name=CONF_NAME):
+    """
+    Get the loaded config to be handed over to pool workers.
+    """
+    get_indexes(conf_name)
+    return _loaded.get(conf_name)
+
+
+def init_worker(conf_name, snapshot):
+    """
+    Pool initializer: take over the config parsed in the parent process.
+    """
+    if snapshot is not None:
+        _loaded[conf_name] = snapshot
+
+
+# The library API, imported last as it builds on the config above
+from .api import Match, search  # noqa: E402,F401
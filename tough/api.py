@@ -0,0 +1,132 @@
+import asyncio
+from collections import deque, namedtuple
+from functools import partial
+
+from . import get_indexes
+from .commands.search import (
+    get_index_chunks,
+    get_query,
+    resolve_indexes,
+    run_on_chunk,
+    searcher,
+)
+from .config import NUM_WORKERS
+from .pool import create_pool
+
+# Matched line: number and byte offset of the line in the uncompressed
+# file, the line as bytes without the line ending
+Match = namedtuple("Match", ["index", "path", "lineno", "offset", "line"])
+
+# Pool shared by the searches not given one
+_pool = None
+
+
+async def search(
+    substring,
+    index,
+    *,
+    regex=None,
+    date_from=None,
+    date_to=None,
+    limit=None,
+    reverse=False,
+    word=False,
+    pool=None,
+    window=NUM_WORKERS * 2,
+):
+    """
+    Search the index, yielding ``Match`` records in the order of the files
+    and lines, or the newest first with ``reverse``. Several indexes are
+    given as comma-separated names or globs. With ``word``, only whole
+    words match.
+
+    The chunks are searched by the worker ``pool``, one shared by all the
+    searches unless given. At most ``window`` chunks of the search are
+    submitted ahead of the consumer, so a slow consumer holds the search
+    back instead of piling up the matches.
+    """
+    if not substring and not regex:
+        raise ValueError("Please provide substring or regex")
+
+    if limit is not None and limit < 1:
+        raise ValueError("limit should be 1 or more")
+
+    indexes = get_indexes()
+    index_names = resolve_indexes(index, indexes)
+
+    loop = asyncio.get_event_loop()
+    items = await loop.run_in_executor(
+        None, get_index_chunks, index_names, date_from, date_to, reverse
+    )
+    queries = {
+        x: get_query(substring, regex, x, indexes[x], word) for x in index_names
+    }
+    func = partial(
+        run_on_chunk, func=searcher, queries=queries, reverse=reverse
+    )
+    pool = pool or get_pool()
+
+    found = 0
+    items = iter(items)
+    pending = deque()
+    try:
+        while True:
+            for item in items:
+                pending.append((item[0], submit(loop, pool, func, item)))
+                if len(pending) >= window:
+                    break
+
+            if not pending:
+                return
+
+            index_name, future = pending.popleft()
+            path, matches = await future
+            for lineno, offset, line in matches:
+                yield Match(index_name, path, lineno, offset, line)
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+    finally:
+        # Results of the chunks submitted ahead are dropped
+        for _, future in pending:
+            future.cancel()
+
+
+def submit(loop, pool, func, item):
+    """
+    Run ``func(item)`` by the pool, returning a future of the event loop.
+    """
+    future = loop.create_future()
+
+    def resolve(method, value):
+        try:
+            loop.call_soon_threadsafe(set_future, future, method, value)
+        except RuntimeError:
+            # The loop is closed, nobody waits for the result
+            pass
+
+    pool.apply_async(
+        func,
+        (item,),
+        callback=partial(resolve, "set_result"),
+        error_callback=partial(resolve, "set_exception"),
+    )
+    return future
+
+
+def set_future(future, method, value):
+    if not future.done():
+        getattr(future, method)(value)
+
+
+def get_pool():
+    """
+    Get the pool shared by the searches, creating it on first use.
+    """
+    global _pool
+
+    if _pool is None:
+        _pool = create_pool()
+
+    return _pool
@@ -0,0 +1,233 @@
+from bisect import bisect
+from collections import OrderedDict
+import os
+import uuid
+
+from .config import BLOCK_CACHE_DIR, BLOCK_CACHE_MEMORY, BLOCK_CACHE_SIZE
+
+# Share of the budget the disk cache is trimmed to when it's exceeded, so
+# that the directory isn't scanned on every write
+TRIM_RATIO = 0.9
+
+# Cache of this process, created on first use
+_cache = None
+
+
+class BlockCache:
+    """
+    LRU cache of decompressed blocks of gzip files.
+
+    Blocks are kept in memory of the process up to ``memory_size`` bytes,
+    and in files of ``directory`` shared by the processes up to ``size``
+    bytes. The least recently used files are removed by modification
+    time, which is updated on every hit.
+    """
+
+    def __init__(self, directory, size=0, memory_size=0):
+        self.directory = directory
+        self.size = size
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        # Bytes on disk as of the last scan plus the bytes written since
+        self.disk_used = None
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            return data
+
+        if self.size:
+            data = self.read(key)
+            if data is not None:
+                self.remember(key, data)
+
+        return data
+
+    def put(self, key, data):
+        self.remember(key, data)
+        if self.size and len(data) <= self.size:
+            self.write(key, data)
+
+    def remember(self, key, data):
+        if len(data) > self.memory_size:
+            return
+
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key))
+
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_size:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+    def read(self, key):
+        fname = os.path.join(self.directory, key)
+        try:
+            with open(fname, "rb") as f:
+                data = f.read()
+
+            os.utime(fname)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def write(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fname = os.path.join(self.directory, key)
+        # Written aside and renamed, so that readers never see a part
+        tmp_fname = f"{fname}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_fname, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp_fname, fname)
+        if self.disk_used is None:
+            self.disk_used = sum(x[1] for x in self.scan())
+        else:
+            self.disk_used += len(data)
+
+        if self.disk_used > self.size:
+            self.trim()
+
+    def trim(self):
+        """
+        Remove the least recently used blocks down to a share of the size.
+        """
+        entries = sorted(self.scan())
+        self.disk_used = sum(x[1] for x in entries)
+        for _, size, fname in entries:
+            if self.disk_used <= self.size * TRIM_RATIO:
+                break
+
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+
+            self.disk_used -= size
+
+    def scan(self):
+        """
+        Get ``(mtime, size, fname)`` of the blocks on disk.
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        return entries
+
+
+class BlockReader:
+    """
+    Reader of a gzip file by blocks between its seek points, which are
+    taken from the cache and decompressed only on a miss.
+
+    ``open_file()`` gives the underlying file, the blocks are cached as
+    ``{key}-{start}-{end}``.
+    """
+
+    def __init__(self, open_file, cache, key, points):
+        self.open_file = open_file
+        self.cache = cache
+        self.key = key
+        self.starts = points if points and points[0] == 0 else [0, *points]
+        self.pos = 0
+        self.block_start = None
+        self.block = b""
+
+    def seek(self, offset):
+        self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        parts = []
+        while size:
+            start = self.pos - self.get_block()
+            end = len(self.block) if size < 0 else start + size
+            data = self.block[start:end]
+            if not data:
+                break
+
+            parts.append(data)
+            self.pos += len(data)
+            if size > 0:
+                size -= len(data)
+
+        return b"".join(parts)
+
+    def readline(self):
+        parts = []
+        while True:
+            start = self.pos - self.get_block()
+            end = self.block.find(b"\n", start) + 1 or len(self.block)
+            data = self.block[start:end]
+            if not data:
+                break
+
+            parts.append(data)
+            self.pos += len(data)
+            if data.endswith(b"\n"):
+                break
+
+        return b"".join(parts)
+
+    def get_block(self):
+        """
+        Load the block of the current position, returning its start.
+        """
+        i = bisect(self.starts, self.pos) - 1
+        start = self.starts[i]
+        if start == self.block_start:
+            return start
+
+        end = self.starts[i + 1] if i + 1 < len(self.starts) else None
+        key = f"{self.key}-{start}-{end}"
+        block = self.cache.get(key)
+        if block is None:
+            f = self.open_file()
+            f.seek(start)
+            block = f.read(-1 if end is None else end - start)
+            self.cache.put(key, block)
+
+        self.block_start = start
+        self.block = block
+        return start
+
+
+def get_block_cache():
+    """
+    Get the block cache of this process, ``None`` if it's turned off.
+    """
+    global _cache
+
+    if not BLOCK_CACHE_SIZE and not BLOCK_CACHE_MEMORY:
+        return None
+
+    if _cache is None:
+        _cache = BlockCache(
+            BLOCK_CACHE_DIR, BLOCK_CACHE_SIZE, BLOCK_CACHE_MEMORY
+        )
+
+    return _cache
+
+
+def file_key(name):
+    """
+    Get key of the file contents that survives renames by logrotate.
+    """
+    stat = os.stat(name)
+    return f"{stat.st_dev}-{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
@@ -0,0 +1,113 @@
+from collections import namedtuple
+import os
+import struct
+
+RECORD = struct.Struct("<QQQQ")
+
+BlockRecord = namedtuple(
+    "BlockRecord", ["line_from", "line_to", "position", "size"]
+)
+
+
+class BlockStore:
+    """
+    Summaries of blocks of lines of a file, e.g. n-grams of the lines.
+
+    The summaries are appended to the data file, and fixed-size records
+    ``(line_from, line_to, position, size)`` to the ``.idx`` file, so
+    the blocks of a line range are found without reading the summaries.
+    Lines not covered by any block are unknown and have to be searched.
+    """
+
+    def __init__(self, fname, reset=False):
+        self.fname = fname
+        self.idx_fname = idx_fname(fname)
+        if reset:
+            self.remove()
+
+    def exists(self):
+        return os.path.isfile(self.idx_fname)
+
+    def remove(self):
+        for fname in (self.fname, self.idx_fname):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+    def append(self, line_from, line_to, data):
+        with open(self.fname, "ab") as f:
+            position = f.tell()
+            f.write(data)
+
+        with open(self.idx_fname, "ab") as f:
+            f.write(RECORD.pack(line_from, line_to, position, len(data)))
+
+    def truncate(self, lineno):
+        """
+        Forget about lines starting from ``lineno``.
+        """
+        if not self.exists():
+            return
+
+        records = [
+            x._replace(line_to=min(x.line_to, lineno))
+            for x in self.records()
+            if x.line_from < lineno
+        ]
+        with open(self.idx_fname, "wb") as f:
+            f.write(b"".join(RECORD.pack(*x) for x in records))
+
+        with open(self.fname, "r+b") as f:
+            f.truncate(
+                records[-1].position + records[-1].size if records else 0
+            )
+
+    def records(self, lo=0, hi=None):
+        """
+        Get records of the blocks overlapping lines ``[lo, hi)``.
+        """
+        try:
+            with open(self.idx_fname, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        return [
+            x
+            for x in map(BlockRecord._make, RECORD.iter_unpack(data))
+            if x.line_to > lo and (hi is None or x.line_from < hi)
+        ]
+
+    def read(self, records):
+        """
+        Yield ``(record, summary)`` for given records.
+        """
+        if not records:
+            return
+
+        with open(self.fname, "rb") as f:
+            for record in records:
+                f.seek(record.position)
+                yield record, f.read(record.size)
+
+
+def idx_fname(fname):
+    return f"{fname}.idx"
+
+
+def exclude_ranges(lo, hi, excluded):
+    """
+    Get parts of ``[lo, hi)`` that are not covered by ``excluded`` ranges.
+    """
+    ranges = []
+    for start, end in sorted(excluded):
+        if start > lo:
+            ranges.append((lo, min(start, hi)))
+
+        lo = max(lo, end)
+        if lo >= hi:
+            break
+
+    if lo < hi:
+        ranges.append((lo, hi))
+
+    return [x for x in ranges if x[0] < x[1]]
@@ -0,0 +1,158 @@
+from hashlib import blake2b
+import os
+import re
+import struct
+
+from .blocks import BlockStore, idx_fname
+from .config import INDEX_DIR
+from .ngram import sre_parse
+
+BITS_PER_TOKEN = 10
+NUM_HASHES = 7
+HEADER = struct.Struct("<IB")
+TOKEN_RE = re.compile(rb"\w+")
+
+# Assertions that there is no token character before or after
+AT_START = (
+    sre_parse.AT_BEGINNING,
+    sre_parse.AT_BEGINNING_LINE,
+    sre_parse.AT_BEGINNING_STRING,
+    sre_parse.AT_BOUNDARY,
+)
+AT_END = (
+    sre_parse.AT_END,
+    sre_parse.AT_END_LINE,
+    sre_parse.AT_END_STRING,
+    sre_parse.AT_BOUNDARY,
+)
+# Character classes without token characters
+NOT_WORD = [
+    [(sre_parse.CATEGORY, sre_parse.CATEGORY_NOT_WORD)],
+    [(sre_parse.CATEGORY, sre_parse.CATEGORY_SPACE)],
+]
+WORD = [(sre_parse.IN, [(sre_parse.CATEGORY, sre_parse.CATEGORY_WORD)])]
+
+
+def encode_bloom(buf):
+    """
+    Build Bloom filter of the tokens of the buffer.
+
+    Tokens are runs of word characters, so they are delimited by
+    whitespace and punctuation.
+    """
+    tokens = set(TOKEN_RE.findall(buf))
+    num_bits = max(64, BITS_PER_TOKEN * len(tokens) + 7) // 8 * 8
+    bits = bytearray(num_bits // 8)
+    for token in tokens:
+        for i in bit_positions(token, num_bits, NUM_HASHES):
+            bits[i >> 3] |= 1 << (i & 7)
+
+    return HEADER.pack(num_bits, NUM_HASHES) + bits
+
+
+def bloom_may_contain(bloom, tokens):
+    """
+    Check whether a block with given Bloom filter may contain all tokens.
+    """
+    num_bits, num_hashes = HEADER.unpack_from(bloom)
+    start = HEADER.size
+    bits = memoryview(bloom)[start:]
+    return all(
+        bits[i >> 3] & (1 << (i & 7))
+        for token in tokens
+        for i in bit_positions(token, num_bits, num_hashes)
+    )
+
+
+def bit_positions(token, num_bits, num_hashes):
+    """
+    Get bit positions of the token, by double hashing.
+    """
+    digest = blake2b(token, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+def query_tokens(regex, substring):
+    """
+    Get whole tokens that every matching line contains.
+
+    A token at an edge of a literal may be a part of a longer one in the
+    line, so it's only taken when the pattern rules out token characters
+    next to it, e.g. with ``\\b``.
+    """
+    literals = [(substring, False, False)]
+    if regex is not None:
+        literals = []
+        if not regex.flags & re.IGNORECASE:
+            items = sre_parse.parse(regex.pattern, regex.flags)
+            collect_token_literals(items, literals)
+
+    tokens = set()
+    for literal, bounded_start, bounded_end in literals:
+        for m in TOKEN_RE.finditer(literal):
+            whole_start = m.start() > 0 or bounded_start
+            whole_end = m.end() < len(literal) or bounded_end
+            if whole_start and whole_end:
+                tokens.add(m.group())
+
+    return sorted(tokens)
+
+
+def collect_token_literals(items, literals):
+    """
+    Collect ``(literal, bounded_start, bounded_end)`` required for the
+    pattern to match, the flags telling whether a token character can't
+    come before or after the literal.
+    """
+    run = bytearray()
+    bounded_start = False
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            run.append(av)
+            continue
+
+        literals.append((bytes(run), bounded_start, is_bound(op, av, 1)))
+        run = bytearray()
+        bounded_start = is_bound(op, av, -1)
+        if op == sre_parse.SUBPATTERN:
+            _, add_flags, _, pattern = av
+            if not add_flags & re.IGNORECASE:
+                collect_token_literals(pattern, literals)
+
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0]:
+            collect_token_literals(av[2], literals)
+
+    literals.append((bytes(run), bounded_start, False))
+
+
+def is_bound(op, av, direction):
+    """
+    Check whether the item rules out a token character next to it: at its
+    start (where a literal before it ends) with ``direction`` 1, at its
+    end with -1.
+    """
+    if op == sre_parse.AT:
+        return av in (AT_END if direction > 0 else AT_START)
+
+    if op == sre_parse.IN:
+        return av in NOT_WORD
+
+    if op == sre_parse.ASSERT_NOT:
+        return av[0] == direction and list(av[1]) == WORD
+
+    return False
+
+
+def get_bloom_store(fname, index_name, reset=False):
+    return BlockStore(bloom_fname(fname, index_name), reset)
+
+
+def bloom_fname(fname, index_name):
+    basename = os.path.basename(fname)
+    return os.path.join(INDEX_DIR, index_name, f"{basename}.bloom")
+
+
+def bloom_idx_fname(fname, index_name):
+    return idx_fname(bloom_fname(fname, index_name))
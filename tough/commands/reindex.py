@@ -1,40 +1,122 @@
-from collections import defaultdict
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 import glob
 from io import BytesIO
-import json
-import multiprocessing as mp
+from itertools import accumulate, chain, groupby
 import os
 
-from .. import get_indexes
-from ..config import DATE_INDEX_NAME, INDEX_DIR, NUM_WORKERS
-from ..eol_mapper import EOLMapper
-from ..opener import fopen
-from ..utils import ensure_index_dir, get_datetime_ex
+from .. import get_indexes, stats
+from ..bloom import bloom_fname, bloom_idx_fname, encode_bloom, get_bloom_store
+from ..config import NUM_FILE_WORKERS, NUM_WORKERS
+from ..date_index import DateIndex
+from ..eol_mapper import ckpt_fname, get_mapper, map_fname
+from ..file_index import (
+    FINGERPRINT_SIZE,
+    FileIndex,
+    FileState,
+    can_resume,
+    fingerprint,
+    is_unchanged,
+)
+from ..ngram import encode_ngrams, get_ngram_store, ngram_fname, ngram_idx_fname
+from ..opener import fopen, gzindex_fname, open_stream, read_head
+from ..pool import create_pool, imap_bounded
+from ..utils import ensure_index_dir, get_datetime_ex, get_extractor
 
 BUF_SIZE = 2 * 1024 * 1024
 
+# Index data kept per file, besides the gzip index
+INDEX_FNAMES = (
+    map_fname,
+    ckpt_fname,
+    ngram_fname,
+    ngram_idx_fname,
+    bloom_fname,
+    bloom_idx_fname,
+)
 
-def run_reindex(index=None):
+
+IndexedFile = namedtuple(
+    "IndexedFile", ["index_name", "filename", "lineno_from", "ranges", "state"]
+)
+IndexedBuffer = namedtuple(
+    "IndexedBuffer", ["block", "spans", "ngrams", "blooms"]
+)
+
+
+def run_reindex(index=None, *, pool=None):
+    """
+    Reindex files of all indexes or of the given one.
+
+    Runs on its own worker pool, unless an existing ``pool`` is given.
+    """
     ensure_index_dir()
     indexes = get_indexes()
-    for index_name, index_conf in indexes.items():
-        if index and index_name != index:
-            continue
+    file_indexes = {}
+    date_indexes = {}
+    to_index = []
+
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool()
+
+    try:
+        for index_name, index_conf in indexes.items():
+            if index and index_name != index:
+                continue
+
+            files = get_index_files(index_conf)
+            file_index = FileIndex(index_name)
+            date_index = DateIndex(index_name)
+            file_indexes[index_name] = file_index
+            date_indexes[index_name] = date_index
 
-        files = get_index_files(index_conf)
-        files = sorted_files(files, index_name)
+            granularity = index_conf["date_granularity"]
+            if date_index.granularity() not in (None, granularity):
+                # Buckets can't be split or merged, the files are indexed
+                # again from the start
+                date_index.clear()
+                file_index.files.clear()
+                file_index.save()
 
-        pool = mp.Pool(NUM_WORKERS)
+            date_index.set_granularity(granularity)
+            date_index.commit()
 
-        try:
-            for path in files:
-                add_to_index(path, index_name, pool=pool)
+            renames, dropped = file_index.match_files(files)
+            apply_renames(index_name, renames, dropped, date_index)
+            file_index.save()
 
-        finally:
+            for path in sorted_files(files, index_name, pool=pool):
+                state = file_index.get(os.path.basename(path))
+                to_index.append((path, index_name, state))
+
+        # Files are indexed concurrently, their results are saved one by one
+        with ThreadPoolExecutor(NUM_FILE_WORKERS) as executor:
+            futures = [
+                executor.submit(add_to_index, *args, pool=pool)
+                for args in to_index
+            ]
+            for future in as_completed(futures):
+                indexed = future.result()
+                if indexed is None:
+                    continue
+
+                save_indexed(
+                    indexed,
+                    file_indexes[indexed.index_name],
+                    date_indexes[indexed.index_name],
+                )
+
+    finally:
+        if own_pool:
             pool.close()
             pool.join()
 
+        for date_index in date_indexes.values():
+            date_index.close()
+
 
 def get_index_files(index_conf):
     return glob.glob(
@@ -42,58 +124,179 @@ def get_index_files(index_conf):
     )
 
 
-def sorted_files(files, index_name):
+def sorted_files(files, index_name, *, pool):
+    first_datetimes = pool.map(
+        partial(get_first_datetime, index_name=index_name), files
+    )
+    to_sort = [
+        (first_datetime, path)
+        for first_datetime, path in zip(first_datetimes, files)
+        # Nothing to index yet, e.g. a freshly rotated file
+        if first_datetime is not None
+    ]
+
+    return [x[1] for x in sorted(to_sort)]
+
+
+def get_first_datetime(path, index_name):
     indexes = get_indexes()
     index_conf = indexes[index_name]
-    datetime_regex = index_conf["datetime_regex"]
-    datetime_format = index_conf["datetime_format"]
-
-    to_sort = []
-    for path in files:
-        with fopen(path, index_name) as f:
-            first_row = next(f)
-            first_datetime = get_datetime_ex(
-                first_row, datetime_regex, datetime_format
-            )
-            to_sort.append((first_datetime, path))
 
-    return [x[1] for x in sorted(to_sort)]
+    with open_stream(path) as f:
+        first_row = f.readline()
 
+    if not first_row:
+        return None
 
-def add_to_index(path, index_name, *, pool):
-    filename = os.path.basename(path)
-    eol_mapper = EOLMapper(path, index_name)
-    eol_mapper.open()
+    return get_datetime_ex(
+        first_row, index_conf["datetime_regex"], index_conf["datetime_format"]
+    )
 
-    date_index_path = os.path.join(INDEX_DIR, index_name, DATE_INDEX_NAME)
-    date_index = {}
-    try:
-        date_index = json.load(open(date_index_path, "r"))
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
 
-    date_index = defaultdict(dict, date_index)
-    cur_lineno = 0
+def add_to_index(path, index_name, state, *, pool):
+    """
+    Index new lines of the file.
 
-    _indexer = partial(indexer, index_name=index_name)
+    Writes the line map, returns the date ranges and the new file state
+    to be saved, or ``None`` if the file hasn't changed.
+    """
+    filename = os.path.basename(path)
+    stat = os.stat(path)
+    if is_unchanged(state, stat):
+        return None
 
     opener = fopen(path, index_name)
+    cur_lineno = 0
+    offset = 0
+    if can_resume(state, stat) and not opener.has_index():
+        cur_lineno = state.lineno
+        offset = state.offset
+
+    if not cur_lineno:
+        opener.reset_index()
+
+    lineno_from = cur_lineno
+    eol_mapper = get_mapper(path, index_name, reset=not cur_lineno)
+    eol_mapper.open()
+    eol_mapper.truncate(cur_lineno)
+    ngram_store = get_ngram_store(path, index_name, reset=not cur_lineno)
+    ngram_store.truncate(cur_lineno)
+    bloom_store = get_bloom_store(path, index_name, reset=not cur_lineno)
+    bloom_store.truncate(cur_lineno)
+
+    ranges = {}
+
+    _indexer = partial(
+        indexer, index_name=index_name, map_class=type(eol_mapper)
+    )
+
     with opener as f:
-        for lines in pool.imap(_indexer, bufferizer(f, BUF_SIZE)):
-            for date, offset in lines:
-                eol_mapper.write(cur_lineno, offset)
-                date_index[date].setdefault(filename, [])
-                if len(date_index[date][filename]) < 2:
-                    date_index[date][filename].append(cur_lineno)
+        f.seek(offset)
+        line_start = offset
+        bufs = stats.timed("reindex.read", bufferizer(f, BUF_SIZE))
+        blocks = imap_bounded(pool, _indexer, bufs, NUM_WORKERS * 2)
+        for block, spans, ngrams, blooms in blocks:
+            with stats.timer("reindex.write_map"):
+                eol_mapper.write_block(cur_lineno, block)
+
+            block_lineno = cur_lineno
+            for date, count in spans:
+                if date in ranges:
+                    ranges[date][1] = cur_lineno + count - 1
                 else:
-                    date_index[date][filename][1] = cur_lineno
-                cur_lineno += 1
+                    ranges[date] = [cur_lineno, cur_lineno + count - 1]
+                cur_lineno += count
+
+            with stats.timer("reindex.write_blocks"):
+                for store, summaries in (
+                    (ngram_store, ngrams),
+                    (bloom_store, blooms),
+                ):
+                    lineno = block_lineno
+                    for count, summary in summaries:
+                        store.append(lineno, lineno + count, summary)
+                        lineno += count
+
+            offsets = block.offsets
+            if offsets:
+                line_start = offsets[-2] if len(offsets) > 1 else offset
+                offset = offsets[-1]
+
+        if cur_lineno and not is_line_complete(f, offset):
+            # The last line is still being written: index it, but resume
+            # from its beginning next time.
+            cur_lineno -= 1
+            offset = line_start
+
         opener.export_index()
 
     eol_mapper.mark_ok()
     eol_mapper.close()
 
-    json.dump(date_index, open(date_index_path, "w"))
+    head = read_head(path, FINGERPRINT_SIZE)
+    state = FileState(
+        stat.st_dev,
+        stat.st_ino,
+        stat.st_size,
+        stat.st_mtime_ns,
+        offset,
+        cur_lineno,
+        fingerprint(head, len(head)),
+        len(head),
+    )
+
+    return IndexedFile(index_name, filename, lineno_from, ranges, state)
+
+
+def save_indexed(indexed, file_index, date_index):
+    with stats.timer("reindex.save"):
+        date_index.trim(indexed.filename, indexed.lineno_from)
+        date_index.update(indexed.filename, indexed.ranges)
+        date_index.commit()
+        file_index.set(indexed.filename, indexed.state)
+        file_index.save()
+
+
+def apply_renames(index_name, renames, dropped, date_index):
+    """
+    Move index data of renamed files and remove the data of missing ones.
+    """
+    if not renames and not dropped:
+        return
+
+    moves = []
+    for old_name, new_name in renames.items():
+        fnames = list(INDEX_FNAMES)
+        if old_name.endswith(".gz") and new_name.endswith(".gz"):
+            fnames.append(gzindex_fname)
+
+        for fname in fnames:
+            moves.append(
+                (fname(old_name, index_name), fname(new_name, index_name))
+            )
+
+    # Move in two steps, so that a chain of renames (log -> log.1 -> log.2)
+    # doesn't overwrite its own files.
+    for src, _ in moves:
+        if os.path.isfile(src):
+            os.replace(src, f"{src}.tmp")
+
+    for name in dropped:
+        for fname in (*INDEX_FNAMES, gzindex_fname):
+            if os.path.isfile(fname(name, index_name)):
+                os.remove(fname(name, index_name))
+
+    for src, dst in moves:
+        if os.path.isfile(f"{src}.tmp"):
+            os.replace(f"{src}.tmp", dst)
+
+    date_index.rename(renames, dropped)
+    date_index.commit()
+
+
+def is_line_complete(f, offset):
+    f.seek(offset - 1)
+    return f.read(1) == b"\n"
 
 
 def bufferizer(f, buf_size):
@@ -104,21 +307,63 @@ def bufferizer(f, buf_size):
             break
 
         buf += f.readline()
+        stats.count("reindex.bytes_read", len(buf))
         yield buf, offset
 
 
-def indexer(args, index_name):
+def indexer(args, index_name, map_class):
+    """
+    Index a buffer of lines.
+
+    Returns the encoded line map block, the dates of the lines as
+    ``[date, number of lines]`` runs, and (if enabled)
+    ``(number of lines, n-grams)`` and ``(number of lines, Bloom filter)``
+    of its blocks of lines.
+    """
     indexes = get_indexes()
     index_conf = indexes[index_name]
-    datetime_regex = index_conf["datetime_regex"]
-    datetime_format = index_conf["datetime_format"]
+    extractor = get_extractor(
+        index_conf["datetime_regex"],
+        index_conf["datetime_format"],
+        index_conf["date_granularity"],
+    )
 
     buf, offset = args
-    stream = BytesIO(buf)
+    lines = BytesIO(buf).readlines()
+    stats.count("reindex.lines", len(lines))
+
+    with stats.timer("reindex.map"):
+        offsets = array("Q", accumulate(chain((offset,), map(len, lines))))
+        block = map_class.encode(offsets[1:], offset)
+
+    with stats.timer("reindex.dates"):
+        spans = [
+            [date, sum(1 for _ in group)]
+            for date, group in groupby(map(extractor.bucket, lines))
+        ]
+
+    ngrams = []
+    if index_conf["ngram_index"]:
+        with stats.timer("reindex.ngrams"):
+            size = index_conf["ngram_block_lines"]
+            ngrams = encode_blocks(lines, size, encode_ngrams)
+
+    blooms = []
+    if index_conf["bloom_index"]:
+        size = index_conf["bloom_block_lines"]
+        blooms = encode_blocks(lines, size, encode_bloom)
+
+    return IndexedBuffer(block, spans, ngrams, blooms)
+
 
-    lines = []
-    for line in stream:
-        date = get_datetime_ex(line, datetime_regex, datetime_format)
-        lines.append((date, offset + stream.tell()))
+def encode_blocks(lines, size, encode):
+    """
+    Encode every ``size`` lines, getting ``[(number of lines, data), ...]``.
+    """
+    blocks = []
+    for start in range(0, len(lines), size):
+        end = start + size
+        block_lines = lines[start:end]
+        blocks.append((len(block_lines), encode(b"".join(block_lines))))
 
-    return lines
+    return blocks
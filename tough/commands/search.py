@@ -1,62 +1,591 @@
+from collections import Counter, deque
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatchcase
 from functools import partial
 import glob
-import json
-import multiprocessing as mp
+import heapq
+from itertools import islice
 import os
 import re
 import sys
+import time
 
 from tqdm import tqdm
 
-from .. import get_indexes
-from ..config import DATE_INDEX_NAME, INDEX_DIR, NUM_WORKERS
-from ..eol_mapper import EOLMapper, chunkify
-from ..opener import fopen
-from ..utils import date_range
+from .. import get_indexes, stats
+from ..blocks import exclude_ranges
+from ..bloom import bloom_may_contain, get_bloom_store, query_tokens
+from ..config import FOLLOW_INTERVAL, NUM_WORKERS
+from ..date_index import DateIndex
+from ..eol_mapper import chunk_cost, chunkify, get_cost, get_mapper, search_cost
+from ..file_index import FINGERPRINT_SIZE, FileIndex, find_source
+from ..ngram import get_ngram_store, may_contain, query_literals
+from ..opener import fopen, read_head
+from ..pool import Stream, create_pool, imap_bounded, imap_streamed
+from ..utils import (
+    GRANULARITIES,
+    bisect_lines,
+    bucket_start,
+    get_extractor,
+    parse_date_arg,
+    parse_datetime_ex,
+)
+from .reindex import run_reindex
 
+SEARCH_BUF_SIZE = 4 * 1024 * 1024
 
-def searcher(chunk, regex, substring, index_name):
-    path, line_start, length, line_end = chunk
-    mapper = EOLMapper(path, index_name)
-    results = []
+# Keys to count matches by: date buckets, index, file name, regex groups
+COUNT_BY_KEYS = (*GRANULARITIES, "index", "file", "group")
 
-    check = lambda x: substring in x  # noqa
-    if regex is not None:
-        check = regex.search
-
-    with fopen(path, index_name) as f:
-        m = mapper.read(line_start)
-        f.seek(m.offset)
-        chunk_line_end = line_start + length
-        if chunk_line_end > line_end:
-            chunk_line_end = line_end + 1
-        for lineno in range(line_start, chunk_line_end):
-            line = f.readline()
-            if chunk_line_end == line_end + 1 and not line:
-                break
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-            if not check(line):
-                continue
 
-            result_line = line.strip()
-            results.append((lineno, result_line))
+def searcher(
+    chunk,
+    regex,
+    substring,
+    index_name,
+    literals=None,
+    tokens=None,
+    reverse=False,
+):
+    """
+    Search a chunk of lines.
 
-    return path, results
+    Returns ``(path, [(lineno, offset, line), ...])``.
+    """
+    batches = search_chunk(
+        chunk, regex, substring, index_name, literals, tokens, reverse
+    )
+    return chunk[0], [x for batch in batches for x in batch]
 
 
-def run_search(substring, regex, index, date_from=None, date_to=None):
-    if not substring and not regex:
-        sys.stderr.write("Please provide substring or --regex (-e) parameter\n")
+def keyed_searcher(
+    chunk,
+    regex,
+    substring,
+    index_name,
+    literals=None,
+    tokens=None,
+    reverse=False,
+):
+    """
+    Search a chunk of lines, keying the matches by their timestamps.
+
+    Returns ``[(key, line), ...]``, see ``get_line_key()``.
+    """
+    index_conf = get_indexes()[index_name]
+    batches = search_chunk(
+        chunk, regex, substring, index_name, literals, tokens, reverse
+    )
+    return [
+        (get_line_key(index_conf, x[-1]), x[-1])
+        for batch in batches
+        for x in batch
+    ]
+
+
+def get_line_key(index_conf, line):
+    """
+    Get timestamp of the line as microseconds since the epoch, ``None``
+    if the line has no timestamp.
+    """
+    try:
+        dt = parse_datetime_ex(
+            line, index_conf["datetime_regex"], index_conf["datetime_format"]
+        )
+    except ValueError:
+        return None
+
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def count_chunk(
+    chunk, regex, substring, index_name, literals=None, tokens=None
+):
+    """
+    Count matches of the chunk, yielding the count per batch.
+    """
+    batches = search_chunk(
+        chunk, regex, substring, index_name, literals, tokens
+    )
+    for batch in batches:
+        yield len(batch)
+
+
+def aggregate_chunk(
+    chunk,
+    count_by,
+    regex,
+    substring,
+    index_name,
+    literals=None,
+    tokens=None,
+):
+    """
+    Count matches of the chunk per key, e.g. per hour and file.
+
+    Keys are tuples of the values listed in ``count_by``.
+    """
+    key_funcs = [get_key_func(x, chunk[0], regex, index_name) for x in count_by]
+    counts = Counter()
+    batches = search_chunk(
+        chunk, regex, substring, index_name, literals, tokens
+    )
+    for batch in batches:
+        counts.update(
+            tuple(func(line) for func in key_funcs) for _, _, line in batch
+        )
+
+    return counts
+
+
+def get_key_func(key, path, regex, index_name):
+    """
+    Get function that gives the ``key`` value of a matched line.
+    """
+    if key == "index":
+        return lambda line: index_name
+
+    if key == "file":
+        filename = os.path.basename(path)
+        return lambda line: filename
+
+    if key == "group":
+
+        def get_groups(line):
+            m = regex.search(line)
+            groups = m.groups() if m else ()
+            return "\t".join(
+                (x or b"").decode(errors="replace") for x in groups
+            )
+
+        return get_groups
+
+    index_conf = get_indexes()[index_name]
+    extractor = get_extractor(
+        index_conf["datetime_regex"], index_conf["datetime_format"], key
+    )
+    return extractor.bucket
+
+
+def search_chunk(
+    chunk,
+    regex,
+    substring,
+    index_name,
+    literals=None,
+    tokens=None,
+    reverse=False,
+):
+    """
+    Search a chunk of lines, yielding matches in batches.
+
+    The chunk is read in blocks of whole lines and each block is scanned
+    at once, only the lines with a match are split out. Given the
+    ``literals`` and ``tokens`` every match contains, blocks of lines
+    whose n-grams or Bloom filters rule them out are skipped.
+    Yields ``[(lineno, offset, line), ...]`` per block with matches, from
+    the last line to the first one if ``reverse`` is set.
+    """
+    path, line_start, length, lines_to = chunk
+    mapper = get_mapper(path, index_name)
+
+    chunk_line_end = min(line_start + length, mapper.count_lines(), lines_to)
+    if chunk_line_end <= line_start:
         return
 
+    # Lines of the chunks, the ones not skipped are counted as scanned
+    stats.count("search.lines", chunk_line_end - line_start)
+    lines_ranges = [(line_start, chunk_line_end)]
+    if literals or tokens:
+        with stats.timer("search.filter"):
+            lines_ranges = filter_lines(
+                path, index_name, line_start, chunk_line_end, literals, tokens
+            )
+
+    matcher = get_matcher(regex, substring)
+    with fopen(path, index_name, cached=True) as f:
+        if not reverse:
+            for lo, hi in lines_ranges:
+                yield from scan_lines(f, mapper, lo, hi, matcher)
+
+            return
+
+        # Blocks are found by the line map from the end and read one by one
+        for lo, hi in reversed(lines_ranges):
+            for block_lo, block_hi in reversed(
+                split_lines(mapper, lo, hi, SEARCH_BUF_SIZE)
+            ):
+                batches = scan_lines(f, mapper, block_lo, block_hi, matcher)
+                batch = [x for batch in batches for x in batch]
+                if batch:
+                    yield batch[::-1]
+
+
+def scan_lines(f, mapper, lo, hi, matcher):
+    """
+    Scan lines ``[lo, hi)`` of the file, yielding batches of matches.
+    """
+    find, check = matcher
+    with stats.timer("map.lookup"):
+        offset_start, offset_end = mapper.span(lo, hi)
+
+    stats.count("search.lines_scanned", hi - lo)
+    lineno = lo
+    offset = offset_start
+    blocks = read_blocks(f, offset_start, offset_end, SEARCH_BUF_SIZE)
+    for buf in stats.timed("search.read", blocks):
+        stats.count("search.bytes_read", len(buf))
+        with stats.timer("search.scan"):
+            batch = []
+            pos = 0
+            for start, end in find_lines(buf, find, check):
+                lineno += buf.count(b"\n", pos, start)
+                batch.append((lineno, offset + start, buf[start:end].strip()))
+                pos = start
+
+            lineno += buf.count(b"\n", pos)
+            offset += len(buf)
+
+        if batch:
+            stats.count("search.matches", len(batch))
+            yield batch
+
+
+def split_lines(mapper, lo, hi, size):
+    """
+    Split lines ``[lo, hi)`` into ranges of about ``size`` bytes.
+    """
+    offset_start, offset_end = mapper.span(lo, hi)
+    step = max(1, (hi - lo) * size // max(offset_end - offset_start, 1))
+    return [(x, min(x + step, hi)) for x in range(lo, hi, step)]
+
+
+def filter_lines(path, index_name, lo, hi, literals, tokens=None):
+    """
+    Get parts of lines ``[lo, hi)`` that may contain all the literals
+    and tokens.
+    """
+    excluded = []
+    filters = [
+        (get_ngram_store, may_contain, literals),
+        (get_bloom_store, bloom_may_contain, tokens),
+    ]
+    for get_store, check, query in filters:
+        if not query:
+            continue
+
+        store = get_store(path, index_name)
+        excluded.extend(
+            (record.line_from, record.line_to)
+            for record, summary in store.read(store.records(lo, hi))
+            if not check(summary, query)
+        )
+
+    return exclude_ranges(lo, hi, excluded)
+
+
+def get_matcher(regex, substring):
+    """
+    Get ``(find, check)`` functions for the query.
+
+    ``find(buf, pos)`` gives the span of the first match in the buffer,
+    ``check(line)`` tells whether a single line matches.
+    """
+    if regex is not None:
+        # Anchors have to match at line boundaries within the buffer
+        search = re.compile(regex.pattern, regex.flags | re.MULTILINE).search
+
+        def find(buf, pos):
+            m = search(buf, pos)
+            return m and m.span()
+
+        return find, regex.search
+
+    def find(buf, pos):
+        start = buf.find(substring, pos)
+        return None if start < 0 else (start, start + len(substring))
+
+    return find, lambda line: substring in line
+
+
+def find_lines(buf, find, check):
+    """
+    Get ``(start, end)`` of the lines of the buffer that have a match.
+
+    A match that spans several lines is only a hint, so the line it starts
+    at is checked on its own.
+    """
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        match = find(buf, pos)
+        if not match or match[0] >= size:
+            return
+
+        match_start, match_end = match
+        start = buf.rfind(b"\n", 0, match_start) + 1
+        end = buf.find(b"\n", match_start) + 1 or size
+        if match_end <= end or check(buf[start:end]):
+            yield start, end
+
+        pos = end
+
+
+def read_blocks(f, offset_start, offset_end, buf_size):
+    """
+    Read ``[offset_start, offset_end)`` in blocks of whole lines.
+    """
+    f.seek(offset_start)
+    offset = offset_start
+    while offset < offset_end:
+        buf = f.read(min(buf_size, offset_end - offset))
+        if not buf:
+            break
+
+        if offset + len(buf) < offset_end and not buf.endswith(b"\n"):
+            buf += f.readline()
+
+        yield buf
+        offset += len(buf)
+
+
+def get_lines_to_search(index_name, index_conf, date_index, date_from, date_to):
+    """
+    Find line ranges of the files that cover given period.
+    """
+    files = {}
+    for _, path, lines_range in get_bucket_ranges(
+        index_name, index_conf, date_index, date_from, date_to
+    ):
+        if path in files:
+            files[path][0] = min(files[path][0], lines_range[0])
+            files[path][1] = max(files[path][1], lines_range[1])
+        else:
+            files[path] = list(lines_range)
+
+    return list(files.items())
+
+
+def get_bucket_ranges(index_name, index_conf, date_index, date_from, date_to):
+    """
+    Find line ranges of the files per date bucket of given period.
+
+    Returns ``(bucket, path, [line_from, line_to])`` in the order of the
+    buckets. Raises ``ValueError`` if the date index was built with another
+    granularity.
+    """
+    bounds = date_index.bounds()
+    if bounds is None:
+        return []
+
+    granularity = index_conf["date_granularity"]
+    if date_index.granularity() != granularity:
+        raise ValueError(
+            f"Date index of {index_name} is by {date_index.granularity()}, "
+            f"reindex it after changing date_granularity"
+        )
+
+    date_from = date_from or bounds[0]
+    date_to = date_to or bounds[1]
+    fmt, _ = GRANULARITIES[granularity]
+    bucket_from = parse_date_arg(date_from)[0].strftime(fmt)
+    bucket_to = parse_date_arg(date_to, end=True)[0].strftime(fmt)
+
+    # Boundaries that fall inside a bucket are looked up in the file itself
+    dt_from = parse_date_arg(date_from)[0]
+    dt_to = parse_date_arg(date_to, end=True)[0]
+    after_to = dt_to + timedelta(microseconds=1)
+    if dt_from == bucket_start(dt_from, granularity):
+        dt_from = None
+
+    if after_to == bucket_start(after_to, granularity):
+        dt_to = None
+
+    ranges = []
+    for bucket, filename, lines_from, lines_to in date_index.find(
+        bucket_from, bucket_to
+    ):
+        path = os.path.join(index_conf["base_dir"], filename.strip("/"))
+        lines_range = [lines_from, lines_to]
+        bucket_dt_from = dt_from if bucket == bucket_from else None
+        bucket_dt_to = dt_to if bucket == bucket_to else None
+        if bucket_dt_from or bucket_dt_to:
+            with stats.timer("search.narrow"):
+                lines_range = narrow_range(
+                    path,
+                    index_name,
+                    index_conf,
+                    lines_range,
+                    bucket_dt_from,
+                    bucket_dt_to,
+                )
+
+        lines = lines_to - lines_from + 1
+        if lines_range is None:
+            stats.count("date_index.skipped_ranges")
+            stats.count("date_index.skipped_lines", lines)
+            continue
+
+        narrowed = lines_range[1] - lines_range[0] + 1
+        ranges.append((bucket, path, lines_range))
+        stats.count("date_index.ranges")
+        stats.count("date_index.lines", narrowed)
+        stats.count("date_index.skipped_lines", lines - narrowed)
+
+    return ranges
+
+
+def narrow_range(path, index_name, index_conf, lines_range, dt_from, dt_to):
+    """
+    Narrow line range down to lines within ``dt_from`` and ``dt_to``.
+
+    Relies on timestamps being monotonic within the file.
+    """
+    mapper = get_mapper(path, index_name)
+    lines_from, lines_to = lines_range
+
+    with fopen(path, index_name, cached=True) as f:
+
+        def get_datetime(lineno):
+            f.seek(mapper.read(lineno).offset)
+            return parse_datetime_ex(
+                f.readline(),
+                index_conf["datetime_regex"],
+                index_conf["datetime_format"],
+            )
+
+        if dt_from:
+            lines_from = bisect_lines(
+                lines_from, lines_to + 1, lambda x: get_datetime(x) >= dt_from
+            )
+
+        if dt_to:
+            after_to = bisect_lines(
+                lines_from, lines_to + 1, lambda x: get_datetime(x) > dt_to
+            )
+            lines_to = after_to - 1
+
+    if lines_from > lines_to:
+        return None
+
+    return [lines_from, lines_to]
+
+
+def run_on_chunk(item, func, queries, **kwargs):
+    """
+    Run ``func`` on ``(index_name, chunk)`` with the query of the index.
+    """
+    index_name, chunk = item
+    return func(chunk, **queries[index_name], **kwargs)
+
+
+def resolve_indexes(names, indexes):
+    """
+    Get the indexes matching comma-separated names or globs, in the order
+    of the config.
+
+    Raises ``ValueError`` if a name or a glob matches none of them.
+    """
+    patterns = [x.strip() for x in names.split(",") if x.strip()]
+    for pattern in patterns or [names]:
+        if not any(fnmatchcase(x, pattern) for x in indexes):
+            raise ValueError(f"No index matches {pattern}")
+
+    return [x for x in indexes if any(fnmatchcase(x, p) for p in patterns)]
+
+
+def get_index_chunks(index_names, date_from=None, date_to=None, reverse=False):
+    """
+    Get ``(index_name, chunk)`` to search, in the order of the output.
+
+    Files of several indexes are split into chunks of about the same cost
+    and the chunks are interleaved by time.
+    """
     indexes = get_indexes()
-    index_conf = indexes[index]
-    index_data = json.load(
-        open(os.path.join(INDEX_DIR, index, DATE_INDEX_NAME))
-    )
+    if len(index_names) == 1:
+        index_name = index_names[0]
+        chunks = get_chunks(
+            index_name, indexes[index_name], date_from, date_to, reverse
+        )
+        return [(index_name, x) for x in chunks]
 
     to_search = []
-    if not date_from and not date_to:
+    for index_name in index_names:
+        date_index = DateIndex(index_name)
+        to_search.extend(
+            (index_name, path, lines_range)
+            for path, lines_range in get_lines_to_search(
+                index_name, indexes[index_name], date_index, date_from, date_to
+            )
+        )
+        date_index.close()
+
+    # Chunks of all the files cost about the same
+    total = sum(
+        search_cost([(path, lines_range)], index_name)
+        for index_name, path, lines_range in to_search
+    )
+    cost = chunk_cost(total)
+    items = by_time(
+        [
+            (index_name, chunk)
+            for index_name, path, lines_range in to_search
+            for chunk in chunkify([(path, lines_range)], index_name, cost=cost)
+        ]
+    )
+    if reverse:
+        items.reverse()
+
+    return items
+
+
+def by_time(items):
+    """
+    Order ``(index_name, chunk)`` by the timestamps of the first lines of
+    the chunks, keeping the order of the chunks of every file.
+    """
+    keys = []
+    last_keys = {}
+    for index_name, chunk in items:
+        key = get_chunk_key(index_name, chunk)
+        last_key = last_keys.get((index_name, chunk[0]), float("-inf"))
+        # Timestamps are out of order a bit at times
+        key = last_key if key is None else max(key, last_key)
+        last_keys[index_name, chunk[0]] = key
+        keys.append(key)
+
+    order = sorted(range(len(items)), key=keys.__getitem__)
+    return [items[x] for x in order]
+
+
+def largest_first(items):
+    """
+    Order ``(index_name, chunk)`` by their cost, the largest first.
+    """
+    mappers = {}
+
+    def get_chunk_cost(item):
+        index_name, (path, line_start, length, _) = item
+        if (index_name, path) not in mappers:
+            mappers[index_name, path] = get_mapper(path, index_name)
+
+        mapper = mappers[index_name, path]
+        return get_cost(path, mapper, line_start, line_start + length)
+
+    return sorted(items, key=get_chunk_cost, reverse=True)
+
+
+def get_chunks(
+    index_name, index_conf, date_from=None, date_to=None, reverse=False
+):
+    """
+    Get chunks of lines to search, in the order of the output.
+    """
+    # Files are ordered by time with the date index only
+    if not date_from and not date_to and not reverse:
         to_search = [
             (x, None)
             for x in glob.glob(
@@ -65,31 +594,350 @@ def run_search(substring, regex, index, date_from=None, date_to=None):
         ]
 
     else:
-        for d in date_range(date_from, date_to):
-            if d not in index_data:
-                continue
-            for filename, lines_range in index_data[d].items():
-                to_search.append(
-                    (
-                        os.path.join(
-                            index_conf["base_dir"], filename.strip("/")
-                        ),
-                        lines_range,
-                    )
-                )
+        date_index = DateIndex(index_name)
+        to_search = get_lines_to_search(
+            index_name, index_conf, date_index, date_from, date_to
+        )
+        date_index.close()
+
+    chunks = list(chunkify(to_search, index_name))
+    if reverse:
+        chunks.reverse()
+
+    return chunks
+
+
+def get_query(substring, regex, index_name, index_conf, word=False):
+    """
+    Get keyword arguments of the chunk searchers for the query.
+
+    With ``word``, the regex or the substring only matches when there are
+    no word characters right before and after it, like ``grep -w``.
+    """
+    if word:
+        regex = rf"(?<!\w)(?:{regex or re.escape(substring)})(?!\w)"
+
+    regex = re.compile(regex.encode()) if regex else None
+    substring = substring.encode()
+    literals = None
+    if index_conf["ngram_index"]:
+        literals = query_literals(regex, substring)
+
+    tokens = None
+    if index_conf["bloom_index"]:
+        tokens = query_tokens(regex, substring)
 
-    func = partial(
-        searcher,
-        regex=re.compile(regex.encode()) if regex else None,
-        substring=substring.encode(),
-        index_name=index,
+    return dict(
+        regex=regex,
+        substring=substring,
+        index_name=index_name,
+        literals=literals,
+        tokens=tokens,
     )
-    chunks = list(chunkify(to_search, index))
-    pool = mp.Pool(NUM_WORKERS)
+
+
+def run_search(
+    substring,
+    regex,
+    index,
+    date_from=None,
+    date_to=None,
+    limit=None,
+    count_only=False,
+    count_by=None,
+    reverse=False,
+    follow=False,
+    sort=False,
+    word=False,
+    *,
+    pool=None,
+    stream=None,
+):
+    """
+    Search the index and print the matches, ordered by their timestamps
+    across the files and indexes with ``sort``.
+
+    ``pool`` and its ``stream`` are created for this search unless given.
+    """
+    if not substring and not regex:
+        sys.stderr.write("Please provide substring or --regex (-e) parameter\n")
+        return
+
+    if limit is not None and limit < 1:
+        sys.stderr.write("--limit (-n) should be 1 or more\n")
+        return
+
+    if limit is not None and count_by:
+        sys.stderr.write("--limit (-n) can't be used with --count-by\n")
+        return
+
+    wrong_keys = set(count_by or []) - set(COUNT_BY_KEYS)
+    if wrong_keys:
+        sys.stderr.write(
+            f"Wrong --count-by: {', '.join(sorted(wrong_keys))}, "
+            f"should be {', '.join(COUNT_BY_KEYS)}\n"
+        )
+        return
+
+    if "group" in (count_by or []) and not regex:
+        sys.stderr.write("Counting by group requires --regex (-e)\n")
+        return
+
+    indexes = get_indexes()
+    try:
+        index_names = resolve_indexes(index, indexes)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return
+
+    if follow and len(index_names) > 1:
+        sys.stderr.write("Only a single index can be followed\n")
+        return
+
+    if follow:
+        index = index_names[0]
+        states = FileIndex(index).files
 
     try:
-        for _, result in tqdm(pool.imap(func, chunks), total=len(chunks)):
-            sys.stdout.write("\n".join(x[1].decode() for x in result) + "\n")
+        with stats.timer("search.plan"):
+            items = get_index_chunks(index_names, date_from, date_to, reverse)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return
+
+    stats.count("search.chunks", len(items))
+    queries = {
+        x: get_query(substring, regex, x, indexes[x], word) for x in index_names
+    }
+    run_query = partial(run_on_chunk, queries=queries)
+
+    own_pool = pool is None
+    if own_pool:
+        stream = Stream()
+        pool = create_pool(stream=stream)
+
+    try:
+        if count_by or count_only:
+            # Order doesn't matter, the workers shouldn't end up waiting
+            # for a large chunk dispatched last
+            items = largest_first(items)
+
+        if count_by:
+            func = partial(run_query, func=aggregate_chunk, count_by=count_by)
+            counts = aggregate_matches(pool, func, items)
+            for key, count in sorted(counts.items()):
+                sys.stdout.write("\t".join((*key, str(count))) + "\n")
+
+            return
+
+        if count_only:
+            func = partial(run_query, func=count_chunk)
+            count = count_matches(pool, stream, func, items, limit)
+            sys.stdout.write(f"{count}\n")
+            return
+
+        if sort:
+            func = partial(run_query, func=keyed_searcher, reverse=reverse)
+            print_sorted(pool, func, items, limit, reverse)
+        else:
+            func = partial(run_query, func=search_chunk, reverse=reverse)
+            print_matches(pool, stream, func, items, limit)
+
+        if follow:
+            # Runs until interrupted
+            func = partial(search_chunk, **queries[index])
+            follow_index(index, indexes[index], pool, stream, func, states)
+
     finally:
-        pool.close()
-        pool.join()
+        if own_pool:
+            pool.close()
+            pool.join()
+
+
+def print_matches(pool, stream, func, chunks, limit=None, progress=True):
+    """
+    Print matches found in the chunks as they come, up to ``limit``.
+    """
+    found = 0
+    results = imap_streamed(pool, stream, func, chunks, NUM_WORKERS * 2)
+    bar = tqdm(total=len(chunks), disable=not progress)
+    with closing(results), bar:
+        for _, batch in results:
+            if batch is None:
+                bar.update()
+                continue
+
+            if limit is not None:
+                batch = batch[: limit - found]
+
+            with stats.timer("output.write"):
+                sys.stdout.write("".join(f"{x[-1].decode()}\n" for x in batch))
+
+            stats.count("output.matches", len(batch))
+            found += len(batch)
+            if limit is not None and found >= limit:
+                break
+
+
+def print_sorted(pool, func, items, limit=None, reverse=False):
+    """
+    Print matches merged by their timestamps, up to ``limit``.
+    """
+    found = 0
+    lines = merge_matches(pool, func, items, reverse)
+    with closing(lines):
+        for line in islice(lines, limit):
+            sys.stdout.write(f"{line.decode()}\n")
+            found += 1
+
+    stats.count("output.matches", found)
+
+
+def merge_matches(pool, func, items, reverse=False, window=NUM_WORKERS * 2):
+    """
+    Merge matches of the chunks by their timestamps, yielding the lines.
+
+    ``func`` gives ``[(key, line), ...]`` of an item, see
+    ``keyed_searcher()``. Lines of a file are in order already, so the
+    files are merged as they go, without collecting the matches: a file
+    is searched only once the output gets to its first line, then at most
+    ``window`` of its chunks are searched ahead. Lines without a timestamp
+    follow the line before them.
+    """
+    sign = -1 if reverse else 1
+    files = {}
+    for item in items:
+        files.setdefault((item[0], item[1][0]), []).append(item)
+
+    starts = []
+    for n, file_items in enumerate(files.values()):
+        key = get_chunk_key(*file_items[0], last=reverse)
+        start = float("-inf") if key is None else sign * key
+        starts.append((start, n, file_items))
+
+    stats.count("merge.files", len(starts))
+    waiting = deque(sorted(starts))
+    heap = []
+
+    def push(n, matches):
+        for key, line in matches:
+            heapq.heappush(heap, (key, n, line, matches))
+            break
+
+    while heap or waiting:
+        # No line of a file comes before its first one
+        while waiting and (not heap or waiting[0][0] <= heap[0][0]):
+            start, n, file_items = waiting.popleft()
+            chunks = imap_bounded(pool, func, file_items, window)
+            push(n, file_matches(chunks, start, sign))
+
+        _, n, line, matches = heapq.heappop(heap)
+        yield line
+        push(n, matches)
+
+
+def file_matches(chunks, key, sign):
+    """
+    Get ``(key, line)`` of the matches of a file, the keys multiplied by
+    ``sign`` and the ones missing taken from the line before.
+    """
+    for matches in chunks:
+        for line_key, line in matches:
+            if line_key is not None:
+                key = sign * line_key
+
+            yield key, line
+
+
+def get_chunk_key(index_name, chunk, last=False):
+    """
+    Get key of the first or the last line of the chunk, see
+    ``get_line_key()``.
+    """
+    path, line_start, length, lines_to = chunk
+    mapper = get_mapper(path, index_name)
+    line_end = min(line_start + length, mapper.count_lines(), lines_to)
+    if line_end <= line_start:
+        return None
+
+    map_line = mapper.read(line_end - 1 if last else line_start)
+    with fopen(path, index_name, cached=True) as f:
+        f.seek(map_line.offset)
+        line = f.readline()
+
+    return get_line_key(get_indexes()[index_name], line)
+
+
+def follow_index(index_name, index_conf, pool, stream, func, states):
+    """
+    Keep reindexing the files and searching the appended lines.
+    """
+    while True:
+        time.sleep(FOLLOW_INTERVAL)
+        states = follow_step(index_name, index_conf, pool, stream, func, states)
+
+
+def follow_step(index_name, index_conf, pool, stream, func, states):
+    """
+    Reindex the files and search the lines appended since ``states``.
+
+    Returns the new file states.
+    """
+    run_reindex(index_name, pool=pool)
+    new_states = FileIndex(index_name).files
+    to_search = []
+    for filename, state in new_states.items():
+        if states.get(filename) == state:
+            continue
+
+        path = os.path.join(index_conf["base_dir"], filename)
+        lineno = get_seen_lines(path, states)
+        if lineno < state.lineno:
+            to_search.append((path, [lineno, state.lineno - 1]))
+
+    chunks = list(chunkify(to_search, index_name))
+    print_matches(pool, stream, func, chunks, progress=False)
+    sys.stdout.flush()
+    return new_states
+
+
+def get_seen_lines(path, states):
+    """
+    Get number of lines of the file already seen under any name.
+    """
+    head = read_head(path, FINGERPRINT_SIZE)
+    source = find_source(states, os.stat(path), head)
+    return states[source].lineno if source is not None else 0
+
+
+def count_matches(pool, stream, func, chunks, limit=None):
+    """
+    Count matches in the chunks, up to ``limit``.
+    """
+    count = 0
+    results = imap_streamed(pool, stream, func, chunks, NUM_WORKERS * 2)
+    bar = tqdm(total=len(chunks))
+    with closing(results), bar:
+        for _, batch_count in results:
+            if batch_count is None:
+                bar.update()
+                continue
+
+            count += batch_count
+            if limit is not None and count >= limit:
+                return limit
+
+    return count
+
+
+def aggregate_matches(pool, func, chunks):
+    """
+    Sum up counts of matches per key over the chunks.
+    """
+    counts = Counter()
+    for chunk_counts in tqdm(
+        pool.imap_unordered(func, chunks), total=len(chunks)
+    ):
+        counts.update(chunk_counts)
+
+    return counts
@@ -0,0 +1,132 @@
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+from .. import stats
+from ..config import KEEP_OPEN_FILES, SERVER_SOCKET
+from ..pool import Stream, create_pool
+from .search import run_search
+
+
+class SearchServer(socketserver.UnixStreamServer):
+    """
+    Search server that keeps the worker pool and its open files.
+
+    A request is a JSON line with the arguments of ``run_search``, the
+    output is streamed back as JSON lines ``{"out": text}`` and
+    ``{"err": text}``. Requests are served one at a time, as they share
+    the pool's stream.
+    """
+
+    def __init__(self, socket_name):
+        self.stream = Stream()
+        self.pool = create_pool(stream=self.stream, open_files=KEEP_OPEN_FILES)
+        super().__init__(socket_name, SearchHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        self.pool.join()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class SearchHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        args = json.loads(line)
+        out = JSONLinesWriter(self.wfile, "out")
+        err = JSONLinesWriter(self.wfile, "err")
+        try:
+            with redirect_stdout(out), redirect_stderr(err):
+                run_search(
+                    **args, pool=self.server.pool, stream=self.server.stream
+                )
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        except Exception as e:
+            err.write(f"{type(e).__name__}: {e}\n")
+
+
+class JSONLinesWriter(io.TextIOBase):
+    """
+    Text stream that sends every write as a JSON line ``{key: text}``.
+    """
+
+    def __init__(self, wfile, key):
+        self.wfile = wfile
+        self.key = key
+
+    def write(self, text):
+        if text:
+            self.wfile.write(json.dumps({self.key: text}).encode() + b"\n")
+
+        return len(text)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+def run_serve(socket_name=SERVER_SOCKET):
+    if connect(socket_name) is not None:
+        sys.stderr.write(f"Server is already running at {socket_name}\n")
+        return
+
+    # Left over by a server that didn't exit cleanly
+    if os.path.exists(socket_name):
+        os.remove(socket_name)
+
+    os.makedirs(os.path.dirname(os.path.abspath(socket_name)), exist_ok=True)
+    with SearchServer(socket_name) as server:
+        # Stop on SIGTERM as on Ctrl-C, removing the socket
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def run_client_search(socket_name=SERVER_SOCKET, **kwargs):
+    """
+    Search through the server if it's running, else in this process.
+
+    Following the files would hold the server, so it's done locally, as
+    well as searches with stats of their own processes.
+    """
+    local = kwargs.get("follow") or stats.enabled()
+    conn = None if local else connect(socket_name)
+    if conn is None:
+        run_search(**kwargs)
+        return
+
+    outputs = {"out": sys.stdout, "err": sys.stderr}
+    with conn, conn.makefile("rwb") as f:
+        f.write(json.dumps(kwargs).encode() + b"\n")
+        f.flush()
+        for line in f:
+            for key, text in json.loads(line).items():
+                outputs[key].write(text)
+
+
+def connect(socket_name):
+    """
+    Connect to the server, ``None`` if it isn't running.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_name)
+    except (FileNotFoundError, ConnectionRefusedError):
+        conn.close()
+        return None
+
+    return conn
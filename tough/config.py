@@ -4,5 +4,29 @@ from pathlib import Path
 CONF_NAME = os.getenv("CONF_NAME", "conf.yaml")
 INDEX_DIR = Path(os.getenv("INDEX_DIR", ".index"))
 DATE_INDEX_NAME = "date_index"
+FILE_INDEX_NAME = "file_index"
 NUM_WORKERS = int(os.getenv("NUM_WORKERS", os.cpu_count()))
-MIN_CHUNK_LENGTH = int(os.getenv("MIN_CHUNK_LENGTH", 300_000))
+# Files reindexed concurrently, all of them feeding the same worker pool
+NUM_FILE_WORKERS = int(os.getenv("NUM_FILE_WORKERS", 4))
+# Search chunks cost at least MIN_CHUNK_BYTES of uncompressed data, a byte
+# of a gzip file costing GZIP_COST_FACTOR bytes, and have at least
+# MIN_CHUNK_LENGTH lines
+MIN_CHUNK_BYTES = int(os.getenv("MIN_CHUNK_BYTES", 16 * 1024 * 1024))
+GZIP_COST_FACTOR = float(os.getenv("GZIP_COST_FACTOR", 4))
+MIN_CHUNK_LENGTH = int(os.getenv("MIN_CHUNK_LENGTH", 1000))
+# Seconds between checks for new lines in search --follow
+FOLLOW_INTERVAL = float(os.getenv("FOLLOW_INTERVAL", 1))
+# Unix socket of tough serve, search goes through it when it's running
+SERVER_SOCKET = os.getenv("SERVER_SOCKET", str(INDEX_DIR / "tough.sock"))
+# Gzip files each worker of tough serve keeps open between searches
+KEEP_OPEN_FILES = int(os.getenv("KEEP_OPEN_FILES", 8))
+# Bytes of decompressed gzip blocks cached on disk in BLOCK_CACHE_DIR and
+# in memory of each process, the cache is off when both are 0
+BLOCK_CACHE_DIR = Path(os.getenv("BLOCK_CACHE_DIR", INDEX_DIR / "block_cache"))
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", 0))
+BLOCK_CACHE_MEMORY = int(os.getenv("BLOCK_CACHE_MEMORY", 0))
+# Collect timers and counters of commands: "1" or "text" for a summary,
+# "json" for JSON, written to stderr
+TRACE = os.getenv("TOUGH_TRACE", "")
+# Directory for cProfile dumps of the processes, when tracing
+PROFILE_DIR = os.getenv("TOUGH_PROFILE_DIR")
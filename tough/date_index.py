@@ -0,0 +1,178 @@
+import json
+import os
+import sqlite3
+
+from .config import DATE_INDEX_NAME, INDEX_DIR
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS date_index (
+    bucket TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    line_from INTEGER NOT NULL,
+    line_to INTEGER NOT NULL,
+    PRIMARY KEY (bucket, filename)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS date_index_filename
+    ON date_index (filename, bucket);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT NOT NULL PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Length of the buckets of the granularities, for indexes made before the
+# granularity was stored
+BUCKET_LENGTHS = {10: "day", 13: "hour", 16: "minute"}
+
+
+class DateIndex:
+    """
+    Line ranges of the files per date bucket.
+
+    Stored in SQLite, so a period is looked up without loading the whole
+    index and reindex updates only the rows of the file being indexed.
+    """
+
+    def __init__(self, index_name):
+        index_dir = os.path.join(INDEX_DIR, index_name)
+        self.fname = os.path.join(index_dir, f"{DATE_INDEX_NAME}.sqlite")
+        self.conn = sqlite3.connect(self.fname)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.import_json(os.path.join(index_dir, DATE_INDEX_NAME))
+
+    def import_json(self, fname):
+        """
+        Import and remove the date index of the previous (JSON) format.
+        """
+        try:
+            data = json.load(open(fname, "r"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        for bucket, files in data.items():
+            for filename, lines_range in files.items():
+                self.update(filename, {bucket: lines_range})
+
+        self.commit()
+        os.remove(fname)
+
+    def find(self, bucket_from, bucket_to):
+        """
+        Get ``(bucket, filename, line_from, line_to)`` for given buckets.
+
+        Within a bucket, the files that started earlier go first.
+        """
+        return self.conn.execute(
+            """
+            SELECT bucket, filename, line_from, line_to
+            FROM date_index AS d
+            WHERE bucket BETWEEN ? AND ?
+            ORDER BY
+                bucket,
+                (
+                    SELECT MIN(bucket) FROM date_index
+                    WHERE filename = d.filename
+                ),
+                filename
+            """,
+            (bucket_from, bucket_to),
+        )
+
+    def bounds(self):
+        """
+        Get the first and the last bucket, or ``None`` if index is empty.
+        """
+        row = self.conn.execute(
+            "SELECT MIN(bucket), MAX(bucket) FROM date_index"
+        ).fetchone()
+        return row if row[0] is not None else None
+
+    def granularity(self):
+        """
+        Get granularity of the buckets, ``None`` if the index is empty.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'granularity'"
+        ).fetchone()
+        if row is not None:
+            return row[0]
+
+        bounds = self.bounds()
+        return bounds and BUCKET_LENGTHS.get(len(bounds[0]))
+
+    def set_granularity(self, granularity):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('granularity', ?)",
+            (granularity,),
+        )
+
+    def clear(self):
+        self.conn.execute("DELETE FROM date_index")
+
+    def update(self, filename, ranges):
+        """
+        Extend line ranges of the file with ``{bucket: [line_from, line_to]}``.
+        """
+        rows = [(b, filename, r[0], r[-1]) for b, r in ranges.items()]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO date_index VALUES (?, ?, ?, ?)", rows
+        )
+        self.conn.executemany(
+            """
+            UPDATE date_index
+            SET line_from = MIN(line_from, ?3), line_to = MAX(line_to, ?4)
+            WHERE bucket = ?1 AND filename = ?2
+            """,
+            rows,
+        )
+
+    def trim(self, filename, lineno):
+        """
+        Drop ranges of the file starting from ``lineno``.
+        """
+        self.conn.execute(
+            "DELETE FROM date_index WHERE filename = ? AND line_from >= ?",
+            (filename, lineno),
+        )
+        self.conn.execute(
+            """
+            UPDATE date_index SET line_to = ?2 - 1
+            WHERE filename = ?1 AND line_to >= ?2
+            """,
+            (filename, lineno),
+        )
+
+    def rename(self, renames, dropped):
+        self.conn.executemany(
+            "DELETE FROM date_index WHERE filename = ?",
+            [(x,) for x in dropped],
+        )
+        # Rename in two steps, so that a chain of renames doesn't collide
+        self.conn.executemany(
+            "UPDATE date_index SET filename = ? WHERE filename = ?",
+            [(f"\0{new}", old) for old, new in renames.items()],
+        )
+        self.conn.executemany(
+            "UPDATE date_index SET filename = ? WHERE filename = ?",
+            [(new, f"\0{new}") for new in renames.values()],
+        )
+
+    def to_dict(self):
+        data = {}
+        for bucket, filename, line_from, line_to in self.find(
+            *(self.bounds() or ("", ""))
+        ):
+            lines_range = [line_from]
+            if line_to > line_from:
+                lines_range.append(line_to)
+
+            data.setdefault(bucket, {})[filename] = lines_range
+
+        return data
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,34 +1,68 @@
+from array import array
+from bisect import bisect
 from collections import namedtuple
+import mmap
 import os
+import struct
+import sys
 
-from .config import INDEX_DIR, MIN_CHUNK_LENGTH, NUM_WORKERS
+from . import INDEX_DEFAULTS, get_indexes
+from .config import (
+    GZIP_COST_FACTOR,
+    INDEX_DIR,
+    MIN_CHUNK_BYTES,
+    MIN_CHUNK_LENGTH,
+    NUM_WORKERS,
+)
+from .opener import fopen
+from .utils import bisect_lines
 
 LEN_OFFSET = 5
 OK = b"OK"
 BUF_SIZE = 2 * 1024 * 1024
 BYTE_ORDER = "little"
 
+# Compact map format. The magic can't be the start of a fixed-width map:
+# as a 40-bit offset it would be about 1 TiB.
+MAGIC = b"\0\0\0\0\xffMAP"
+VERSION = 1
+FLAG_DELTA = 1
+FLAG_CHECKPOINTS = 2
+FLAGS = FLAG_DELTA | FLAG_CHECKPOINTS
+CHECKPOINT_INTERVAL = INDEX_DEFAULTS["map_checkpoint_interval"]
+HEADER = struct.Struct("<8sBBIQQQ")
+CHECKPOINT = struct.Struct("<QQ")
+
 MapLine = namedtuple("MapLine", ["lineno", "offset", "length"])
+MapBlock = namedtuple("MapBlock", ["offsets", "start", "data", "positions"])
+MapHeader = namedtuple(
+    "MapHeader",
+    ["magic", "version", "flags", "interval", "count", "offset", "size"],
+)
 
 
 class EOLMapper:
     """
     File EOL mapper.
+
+    The map holds the end offset of every line as a 40-bit little-endian
+    integer. Reads go through a memory map of the file, writes are done in
+    batches with one syscall per batch.
     """
 
     def __init__(self, fname, index_name):
-        basename = os.path.basename(fname)
-        self.map_fname = os.path.join(INDEX_DIR, index_name, f"{basename}.map")
+        self.map_fname = map_fname(fname, index_name)
 
         if not os.path.isfile(self.map_fname):
             # Create empty map file
             open(self.map_fname, "w").close()
 
         self.f = None
-        self.f_read = open(self.map_fname, "rb")
+        self.f_read = open(self.map_fname, "rb", buffering=0)
+        self.mm = b""
 
     def open(self):
-        self.f = open(self.map_fname, "r+b")
+        self.f = open(self.map_fname, "r+b", buffering=0)
 
     def close(self):
         self.f.close()
@@ -37,53 +71,474 @@ class EOLMapper:
         if lineno >= self.count_lines() or lineno < 0:
             return None
 
-        f = self.f_read
-        f.seek(LEN_OFFSET * max(lineno - 1, 0))
-
-        if lineno > 0:
-            record = f.read(LEN_OFFSET * 2)
-            offset_start = int.from_bytes(record[:LEN_OFFSET], BYTE_ORDER)
-            offset_end = int.from_bytes(record[LEN_OFFSET:], BYTE_ORDER)
-        else:
-            record = f.read(LEN_OFFSET)
-            offset_start = 0
-            offset_end = int.from_bytes(record[:LEN_OFFSET], BYTE_ORDER)
-
+        offset_start, offset_end = self.span(lineno, lineno + 1)
         length = offset_end - offset_start - 1
 
         return MapLine(lineno, offset_start, length)
 
+    def read_range(self, lo, hi):
+        """
+        Get end offsets of lines from ``lo`` to ``hi`` (exclusive).
+        """
+        start, end = LEN_OFFSET * lo, LEN_OFFSET * hi
+        return unpack_offsets(self._view(end)[start:end])
+
+    def span(self, lo, hi):
+        """
+        Get byte range occupied by lines from ``lo`` to ``hi`` (exclusive).
+        """
+        start = 0
+        if lo > 0:
+            start = self._read_offset(lo - 1)
+
+        return start, self._read_offset(hi - 1)
+
     def write(self, lineno, offset):
-        record = offset.to_bytes(LEN_OFFSET, BYTE_ORDER)
-        self.f.seek(LEN_OFFSET * lineno)
-        self.f.write(record)
+        self.write_many(lineno, [offset])
+
+    @staticmethod
+    def encode(offsets, start):
+        """
+        Prepare a block of lines for ``write_block``.
+
+        Can be done in a worker process: doesn't depend on the map state.
+        """
+        return MapBlock(offsets, start, None, None)
+
+    def write_block(self, lineno, block):
+        self.write_many(lineno, block.offsets)
+
+    def write_many(self, start_lineno, offsets):
+        self.f.seek(LEN_OFFSET * start_lineno)
+        self.f.write(pack_offsets(offsets))
+
+    def truncate(self, lineno):
+        """
+        Drop all lines starting from ``lineno`` (and the OK mark).
+        """
+        self._unmap()
+        self.f.truncate(LEN_OFFSET * lineno)
 
     def count_lines(self):
-        return os.path.getsize(self.map_fname) // LEN_OFFSET
+        return os.fstat(self.f_read.fileno()).st_size // LEN_OFFSET
 
     def mark_ok(self):
         self.f.seek(0, 2)
         self.f.write(OK)
 
+    def _read_offset(self, lineno):
+        start, end = LEN_OFFSET * lineno, LEN_OFFSET * (lineno + 1)
+        return int.from_bytes(self._view(end)[start:end], BYTE_ORDER)
+
+    def _view(self, size):
+        if len(self.mm) < size:
+            self._unmap()
+            if os.fstat(self.f_read.fileno()).st_size:
+                self.mm = mmap.mmap(
+                    self.f_read.fileno(), 0, access=mmap.ACCESS_READ
+                )
+
+        return self.mm
+
+    def _unmap(self):
+        if self.mm:
+            self.mm.close()
+            self.mm = b""
+
+
+def pack_offsets(offsets):
+    """
+    Pack offsets into 40-bit records without a per-offset Python loop.
+    """
+    wide = array("Q", offsets)
+    if sys.byteorder != BYTE_ORDER:
+        wide.byteswap()
+
+    wide = wide.tobytes()
+    buf = bytearray(LEN_OFFSET * len(offsets))
+    for i in range(LEN_OFFSET):
+        buf[i::LEN_OFFSET] = wide[i::8]
+
+    return buf
+
+
+def unpack_offsets(buf):
+    wide = bytearray(8 * (len(buf) // LEN_OFFSET))
+    for i in range(LEN_OFFSET):
+        wide[i::8] = buf[i::LEN_OFFSET]
+
+    offsets = array("Q", wide)
+    if sys.byteorder != BYTE_ORDER:
+        offsets.byteswap()
+
+    return offsets
+
+
+class CompactEOLMapper(EOLMapper):
+    """
+    Compact file EOL mapper.
+
+    The map holds a header followed by line lengths encoded as varints.
+    Every ``interval`` lines the absolute offset and the position of the
+    varint are stored in a ``.ckpt`` file, so a line is found with one
+    checkpoint lookup and at most ``interval`` varints to decode.
+    """
+
+    def __init__(self, fname, index_name, interval=CHECKPOINT_INTERVAL):
+        super().__init__(fname, index_name)
+        self.ckpt_fname = ckpt_fname(fname, index_name)
+        if not os.path.isfile(self.ckpt_fname):
+            open(self.ckpt_fname, "w").close()
+
+        self.interval = interval
+        self.f_ckpt = None
+        self.f_ckpt_read = open(self.ckpt_fname, "rb", buffering=0)
+
+    def open(self):
+        super().open()
+        self.f_ckpt = open(self.ckpt_fname, "r+b", buffering=0)
+        if not os.fstat(self.f.fileno()).st_size:
+            self._write_header(self._read_header())
+
+    def close(self):
+        super().close()
+        self.f_ckpt.close()
+
+    def read_range(self, lo, hi):
+        header = self._read_header()
+        hi = min(hi, header.count)
+        if hi <= lo:
+            return array("Q")
+
+        offset, pos = self._locate(lo, header)
+        mm = self._view(HEADER.size + header.size)
+        offsets, _ = decode_offsets(mm, HEADER.size + pos, offset, hi - lo)
+        return array("Q", offsets)
+
+    def span(self, lo, hi):
+        header = self._read_header()
+        return self._locate(lo, header)[0], self._locate(hi, header)[0]
+
+    def write_many(self, start_lineno, offsets):
+        header = self._read_header()
+        if start_lineno < header.count:
+            header = header._replace(offset=self._locate(start_lineno)[0])
+
+        self.write_block(start_lineno, self.encode(offsets, header.offset))
+
+    @staticmethod
+    def encode(offsets, start):
+        return MapBlock(offsets, start, *encode_offsets(offsets, start))
+
+    def write_block(self, lineno, block):
+        header = self._read_header()
+        if lineno < header.count:
+            self.truncate(lineno)
+            header = self._read_header()
+
+        if lineno != header.count or block.start != header.offset:
+            raise ValueError("Compact map can only be appended to")
+
+        checkpoints = bytearray()
+        first = -lineno % header.interval
+        for i in range(first, len(block.offsets), header.interval):
+            start = block.offsets[i - 1] if i else block.start
+            pos = header.size + block.positions[i]
+            checkpoints += CHECKPOINT.pack(start, pos)
+
+        self.f.seek(HEADER.size + header.size)
+        self.f.write(block.data)
+        self.f_ckpt.seek(CHECKPOINT.size * n_checkpoints(header))
+        self.f_ckpt.write(checkpoints)
+        self._write_header(
+            header._replace(
+                count=header.count + len(block.offsets),
+                offset=block.offsets[-1] if block.offsets else header.offset,
+                size=header.size + len(block.data),
+            )
+        )
+
+    def truncate(self, lineno):
+        header = self._read_header()
+        if lineno >= header.count:
+            return
+
+        offset, pos = self._locate(lineno)
+        header = header._replace(count=lineno, offset=offset, size=pos)
+        self._unmap()
+        self.f.truncate(HEADER.size + pos)
+        self.f_ckpt.truncate(CHECKPOINT.size * n_checkpoints(header))
+        self._write_header(header)
+
+    def count_lines(self):
+        return self._read_header().count
+
+    def mark_ok(self):
+        pass
+
+    def _locate(self, lineno, header=None):
+        """
+        Get start offset of the line and position of its varint.
+        """
+        header = header or self._read_header()
+        if lineno >= header.count:
+            return header.offset, header.size
+
+        f = self.f_ckpt_read
+        f.seek(CHECKPOINT.size * (lineno // header.interval))
+        offset, pos = CHECKPOINT.unpack(f.read(CHECKPOINT.size))
+
+        skip = lineno % header.interval
+        if skip:
+            mm = self._view(HEADER.size + header.size)
+            offsets, pos = decode_offsets(mm, HEADER.size + pos, offset, skip)
+            offset, pos = offsets[-1], pos - HEADER.size
+
+        return offset, pos
+
+    def _read_header(self):
+        self.f_read.seek(0)
+        record = self.f_read.read(HEADER.size)
+        if not record:
+            return MapHeader(MAGIC, VERSION, FLAGS, self.interval, 0, 0, 0)
+
+        header = MapHeader(*HEADER.unpack(record))
+        if header.magic != MAGIC or header.flags & ~FLAGS:
+            raise ValueError(f"Unsupported map format: {self.map_fname}")
+
+        return header
+
+    def _write_header(self, header):
+        self.f.seek(0)
+        self.f.write(HEADER.pack(*header))
+
+
+def n_checkpoints(header):
+    return -(-header.count // header.interval)
+
+
+def encode_offsets(offsets, start):
+    """
+    Encode line end offsets as varint deltas.
+
+    Returns the encoded data and the position of every line's varint.
+    """
+    data = bytearray()
+    positions = array("I")
+    prev = start
+    for offset in offsets:
+        positions.append(len(data))
+        delta = offset - prev
+        while delta > 0x7F:
+            data.append(delta & 0x7F | 0x80)
+            delta >>= 7
+
+        data.append(delta)
+        prev = offset
 
-def chunkify(to_search, index_name, min_chunk_length=MIN_CHUNK_LENGTH):
+    return data, positions
+
+
+def decode_offsets(buf, pos, offset, count):
+    """
+    Decode ``count`` varint deltas starting at ``pos``.
+
+    Returns line end offsets and the position after the last varint.
+    """
+    offsets = []
+    for _ in range(count):
+        delta = shift = 0
+        while True:
+            byte = buf[pos]
+            pos += 1
+            delta |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+
+            shift += 7
+
+        offset += delta
+        offsets.append(offset)
+
+    return offsets, pos
+
+
+def get_mapper(fname, index_name, reset=False):
+    """
+    Get EOL mapper of the file, creating the map in the configured format.
+    """
+    name = map_fname(fname, index_name)
+    if reset:
+        for path in (name, ckpt_fname(fname, index_name)):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    head = b""
+    if os.path.isfile(name):
+        with open(name, "rb") as f:
+            head = f.read(len(MAGIC))
+
+    if head == MAGIC:
+        return CompactEOLMapper(fname, index_name)
+
+    if head:
+        return EOLMapper(fname, index_name)
+
+    index_conf = get_indexes()[index_name]
+    if index_conf["map_format"] == "fixed":
+        return EOLMapper(fname, index_name)
+
+    return CompactEOLMapper(
+        fname,
+        index_name,
+        index_conf["map_checkpoint_interval"],
+    )
+
+
+def map_fname(fname, index_name):
+    basename = os.path.basename(fname)
+    return os.path.join(INDEX_DIR, index_name, f"{basename}.map")
+
+
+def ckpt_fname(fname, index_name):
+    return f"{map_fname(fname, index_name)}.ckpt"
+
+
+def chunkify(
+    to_search, index_name, min_chunk_length=MIN_CHUNK_LENGTH, cost=None
+):
+    """
+    Split lines to search into chunks of about the same cost.
+
+    Yields ``(path, line_start, length, lines_to)``, where ``lines_to`` is
+    the (exclusive) end of the whole range being searched in the file.
+    A chunk costs about ``cost``, by default the one ``chunk_cost()``
+    gives for all the lines, see ``get_cost()``. Chunks of gzip files
+    start at the seek points, so no part of a file is decompressed twice.
+    """
+    ranges = []
+    for path, lines_range in to_search:
+        mapper = get_mapper(path, index_name)
+        ranges.append((path, mapper, *get_lines(mapper, lines_range)))
+
+    if cost is None:
+        cost = chunk_cost(sum(get_cost(*x) for x in ranges))
+
+    for path, mapper, lines_from, lines_to in ranges:
+        starts = split_cost(
+            path, mapper, lines_from, lines_to, cost, min_chunk_length
+        )
+        points = fopen(path, index_name).seek_points()
+        if len(starts) > 1 and points:
+            starts = align_starts(mapper, starts, points, lines_to)
+
+        ends = starts[1:] + [lines_to]
+        for line_start, line_end in zip(starts, ends):
+            yield path, line_start, line_end - line_start, lines_to
+
+
+def get_lines(mapper, lines_range):
+    """
+    Get ``(lines_from, lines_to)`` of a range of the date index, the whole
+    file if it's ``None``.
+    """
+    if lines_range is None:
+        return 0, mapper.count_lines()
+
+    if len(lines_range) == 1:
+        return lines_range[0], lines_range[0] + 1
+
+    if len(lines_range) == 2:
+        return lines_range[0], lines_range[1] + 1
+
+    raise ValueError("Wrong date index")
+
+
+def search_cost(to_search, index_name):
+    """
+    Get cost of searching the lines, see ``get_cost()``.
+    """
+    total = 0
     for path, lines_range in to_search:
-        lines_from = 0
-        lines_to = EOLMapper(path, index_name).count_lines()
-        length = min_chunk_length
-        if lines_range is not None:
-            if len(lines_range) == 1:
-                lines_from = lines_range[0]
-                lines_to = lines_from + 1
-                length = 1
-
-            elif len(lines_range) == 2:
-                lines_from, lines_to = lines_range
-                lines = lines_to - lines_from
-                length = max(round(lines / (NUM_WORKERS * 4)), min_chunk_length)
-
-            else:
-                raise ValueError("Wrong date index")
-
-        for line_start in range(lines_from, lines_to, length):
-            yield path, line_start, length, lines_to
+        mapper = get_mapper(path, index_name)
+        total += get_cost(path, mapper, *get_lines(mapper, lines_range))
+
+    return total
+
+
+def chunk_cost(total):
+    """
+    Get cost of a chunk that gives every worker several chunks of the
+    ``total``, but no less than ``MIN_CHUNK_BYTES``.
+    """
+    return max(MIN_CHUNK_BYTES, total / (NUM_WORKERS * 4), 1)
+
+
+def get_cost(path, mapper, lo, hi):
+    """
+    Get cost of searching lines ``[lo, hi)`` of the file: their
+    uncompressed bytes, multiplied by ``GZIP_COST_FACTOR`` in gzip files.
+    """
+    hi = min(hi, mapper.count_lines())
+    if hi <= lo:
+        return 0
+
+    offset_from, offset_to = mapper.span(lo, hi)
+    factor = GZIP_COST_FACTOR if path.endswith(".gz") else 1
+    return (offset_to - offset_from) * factor
+
+
+def split_cost(path, mapper, lines_from, lines_to, cost, min_chunk_length):
+    """
+    Get starts of chunks of lines ``[lines_from, lines_to)`` that cost
+    about ``cost`` and have at least ``min_chunk_length`` lines.
+    """
+    total = get_cost(path, mapper, lines_from, lines_to)
+    if total <= cost:
+        return [lines_from]
+
+    lines_to = min(lines_to, mapper.count_lines())
+    offset_from, offset_to = mapper.span(lines_from, lines_to)
+    step = (offset_to - offset_from) * cost / total
+    starts = [lines_from]
+    offset = offset_from + step
+    while offset < offset_to:
+        lo = starts[-1] + min_chunk_length
+        start = first_line_after(mapper, offset, lo, lines_to)
+        if start >= lines_to:
+            break
+
+        starts.append(start)
+        offset = max(offset + step, mapper.span(start, start + 1)[0] + step)
+
+    return starts
+
+
+def align_starts(mapper, starts, points, lines_to):
+    """
+    Move chunk starts to the first lines after the nearest seek points.
+    """
+    lines_from = starts[0]
+    offset_from, offset_to = mapper.span(lines_from, lines_to)
+    point_lines = [
+        first_line_after(mapper, point, lines_from + 1, lines_to)
+        for point in points
+        if offset_from < point < offset_to
+    ]
+    if not point_lines:
+        return starts[:1]
+
+    aligned = {lines_from}
+    for start in starts[1:]:
+        i = bisect(point_lines, start)
+        lo, hi = max(i - 1, 0), i + 1
+        aligned.add(min(point_lines[lo:hi], key=lambda x: abs(x - start)))
+
+    return sorted(x for x in aligned if x < lines_to)
+
+
+def first_line_after(mapper, offset, lo, hi):
+    """
+    Find the first line in ``[lo, hi)`` that starts at ``offset`` or later.
+    """
+    return bisect_lines(lo, hi, lambda x: mapper.span(x, x + 1)[0] >= offset)
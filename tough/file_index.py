@@ -0,0 +1,157 @@
+from collections import namedtuple
+import hashlib
+import json
+import os
+
+from .config import FILE_INDEX_NAME, INDEX_DIR
+from .opener import read_head
+
+FINGERPRINT_SIZE = 1024
+
+FileState = namedtuple(
+    "FileState",
+    [
+        "dev",
+        "ino",
+        "size",
+        "mtime",
+        "offset",
+        "lineno",
+        "fingerprint",
+        "fingerprint_size",
+    ],
+)
+
+
+class FileIndex:
+    """
+    Per-file reindex state: file identity and high-water mark.
+
+    ``offset`` and ``lineno`` point right after the last complete line that
+    has been indexed, so the next reindex can resume from there.
+    A file is identified by its inode and by a fingerprint of its first
+    (uncompressed) bytes, so index data follows the file when it's renamed
+    or compressed by logrotate.
+    """
+
+    def __init__(self, index_name):
+        self.fname = os.path.join(INDEX_DIR, index_name, FILE_INDEX_NAME)
+        self.files = {}
+        try:
+            data = json.load(open(self.fname, "r"))
+            self.files = {k: FileState(**v) for k, v in data.items()}
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            pass
+
+    def get(self, filename):
+        return self.files.get(filename)
+
+    def set(self, filename, state):
+        self.files[filename] = state
+
+    def save(self):
+        data = {k: v._asdict() for k, v in self.files.items()}
+        json.dump(data, open(self.fname, "w"))
+
+    def match_files(self, paths):
+        """
+        Match files on disk against the known file states.
+
+        Returns ``(renames, dropped)``: ``renames`` maps old file names to
+        new ones, ``dropped`` lists the names whose index data is stale.
+        The states are updated accordingly.
+        """
+        kept = {}
+        unmatched = []
+        for path in paths:
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            state = self.files.get(name)
+            if is_unchanged(state, stat):
+                kept[name] = state
+                continue
+
+            head = read_head(path, FINGERPRINT_SIZE)
+            if is_same_file(state, stat, head):
+                kept[name] = state
+            else:
+                unmatched.append((path, name, stat, head))
+
+        sources = {k: v for k, v in self.files.items() if k not in kept}
+        renames = {}
+        for path, name, stat, head in unmatched:
+            old_name = find_source(sources, stat, head)
+            if old_name is None:
+                continue
+
+            state = sources.pop(old_name)
+            if (state.dev, state.ino) != (stat.st_dev, stat.st_ino):
+                # Compressed or copied rotation: the line map still holds,
+                # but the file has to be opened and checked as a new one.
+                state = state._replace(
+                    dev=stat.st_dev, ino=stat.st_ino, size=0, mtime=0
+                )
+
+            renames[old_name] = name
+            kept[name] = state
+
+        self.files = kept
+        return renames, list(sources)
+
+
+def fingerprint(head, size):
+    return hashlib.sha1(head[:size]).hexdigest()
+
+
+def is_same_content(state, head):
+    if not state.fingerprint_size or len(head) < state.fingerprint_size:
+        return False
+
+    return fingerprint(head, state.fingerprint_size) == state.fingerprint
+
+
+def is_same_file(state, stat, head):
+    if state is None:
+        return False
+
+    same_inode = (state.dev, state.ino) == (stat.st_dev, stat.st_ino)
+    return same_inode and is_same_content(state, head)
+
+
+def find_source(states, stat, head):
+    """
+    Find the state of the file that has been renamed to the given one.
+
+    Prefer the one with the same inode, then any with the same content.
+    """
+    found = None
+    for name, state in states.items():
+        if not is_same_content(state, head):
+            continue
+
+        if (state.dev, state.ino) == (stat.st_dev, stat.st_ino):
+            return name
+
+        found = found or name
+
+    return found
+
+
+def is_unchanged(state, stat):
+    return state is not None and (
+        state.dev,
+        state.ino,
+        state.size,
+        state.mtime,
+    ) == (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def can_resume(state, stat):
+    """
+    Check whether the file has only been appended to since the last run.
+    """
+    if state is None:
+        return False
+
+    same_file = (state.dev, state.ino) == (stat.st_dev, stat.st_ino)
+    return same_file and stat.st_size >= state.size
@@ -0,0 +1,118 @@
+import os
+import re
+import zlib
+
+from .blocks import BlockStore, idx_fname
+from .config import INDEX_DIR
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+NGRAM_SIZE = 3
+NGRAM_RE = re.compile(b"." * NGRAM_SIZE, re.DOTALL)
+
+
+def get_ngrams(buf):
+    ngrams = set()
+    for i in range(NGRAM_SIZE):
+        ngrams.update(NGRAM_RE.findall(buf, i))
+
+    return ngrams
+
+
+def encode_ngrams(buf):
+    """
+    Get sorted distinct n-grams of the buffer, compressed.
+    """
+    return zlib.compress(b"".join(sorted(get_ngrams(buf))), 1)
+
+
+def may_contain(summary, literals):
+    """
+    Check whether a block with given n-grams may contain all the literals.
+    """
+    data = zlib.decompress(summary)
+    return all(
+        has_ngram(data, ngram)
+        for literal in literals
+        for ngram in get_ngrams(literal)
+    )
+
+
+def has_ngram(data, ngram):
+    lo, hi = 0, len(data) // NGRAM_SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, end = mid * NGRAM_SIZE, (mid + 1) * NGRAM_SIZE
+        found = data[start:end]
+        if found == ngram:
+            return True
+
+        if found < ngram:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return False
+
+
+def query_literals(regex, substring):
+    """
+    Get literals that every matching line contains, long enough to be
+    looked up by n-grams.
+    """
+    return [
+        x for x in required_literals(regex, substring) if len(x) >= NGRAM_SIZE
+    ]
+
+
+def required_literals(regex, substring):
+    """
+    Get literals that every matching line contains.
+    """
+    if regex is None:
+        return [substring]
+
+    literals = []
+    if not regex.flags & re.IGNORECASE:
+        collect_literals(sre_parse.parse(regex.pattern, regex.flags), literals)
+
+    return [x for x in literals if x]
+
+
+def collect_literals(items, literals):
+    """
+    Collect runs of literals that are required for the pattern to match.
+    """
+    run = bytearray()
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            run.append(av)
+            continue
+
+        literals.append(bytes(run))
+        run = bytearray()
+        if op == sre_parse.SUBPATTERN:
+            _, add_flags, _, pattern = av
+            if not add_flags & re.IGNORECASE:
+                collect_literals(pattern, literals)
+
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0]:
+            collect_literals(av[2], literals)
+
+    literals.append(bytes(run))
+
+
+def get_ngram_store(fname, index_name, reset=False):
+    return BlockStore(ngram_fname(fname, index_name), reset)
+
+
+def ngram_fname(fname, index_name):
+    basename = os.path.basename(fname)
+    return os.path.join(INDEX_DIR, index_name, f"{basename}.ngram")
+
+
+def ngram_idx_fname(fname, index_name):
+    return idx_fname(ngram_fname(fname, index_name))
@@ -1,14 +1,31 @@
+from collections import OrderedDict
+import gzip
 import os
+import struct
 
 import indexed_gzip as igzip
 
+from . import get_indexes
+from .block_cache import BlockReader, file_key, get_block_cache
 from .config import INDEX_DIR
 
+# Exported gzip index: header and seek point records by format version,
+# the windows of the points follow the point table.
+GZINDEX_MAGIC = b"GZIDX"
+GZINDEX_HEADER = struct.Struct("<5sBBQQIII")
+GZINDEX_POINT = {0: struct.Struct("<QQB"), 1: struct.Struct("<QQBB")}
+
+# Gzip files kept open between reads, the least recently used first:
+# name -> (state of the file and its gzip index, file)
+_kept_files = OrderedDict()
+_keep_files = 0
+
 
 class Opener:
-    def __init__(self, name, index_name):
+    def __init__(self, name, index_name, cached=False):
         self.name = name
         self.index_name = index_name
+        self.cached = cached
         self.file = None
 
     def __enter__(self):
@@ -24,6 +41,19 @@ class Opener:
     def export_index(self):
         pass
 
+    def has_index(self):
+        return False
+
+    def reset_index(self):
+        pass
+
+    def seek_points(self):
+        """
+        Get uncompressed offsets where reading can start without
+        decompressing anything before.
+        """
+        return []
+
 
 class TextFileOpener(Opener):
     def open(self):
@@ -31,29 +61,161 @@ class TextFileOpener(Opener):
 
 
 class GzipFileOpener(Opener):
+    """
+    Opener of gzip files with random access by the exported gzip index.
+
+    With ``keep_files()`` enabled, the files stay open along with the
+    imported index while neither the file nor the index changes. With
+    ``cached``, the file is read by blocks through the block cache.
+    """
+
+    def __init__(self, name, index_name, cached=False):
+        super().__init__(name, index_name, cached)
+        self.gzindex_name = gzindex_fname(name, index_name)
+        self.kept = False
+
+    def __enter__(self):
+        cache = get_block_cache() if self.cached else None
+        points = self.seek_points() if cache is not None else []
+        if points:
+            # The file is opened only if some block isn't cached
+            return BlockReader(
+                self.open_file, cache, file_key(self.name), points
+            )
+
+        return self.open_file()
+
+    def __exit__(self, *args):
+        if self.file is not None and not self.kept:
+            self.file.close()
+
+    def open_file(self):
+        if self.file is None:
+            self.file = self.open_kept() if _keep_files else self.open()
+
+        return self.file
+
+    def open_kept(self):
+        state = file_state(self.name, self.gzindex_name)
+        kept = _kept_files.pop(self.name, None)
+        if kept is not None and kept[0] != state:
+            kept[1].close()
+            kept = None
+
+        if kept is None:
+            kept = (state, self.open())
+
+        _kept_files[self.name] = kept
+        keep_files(_keep_files)
+        self.kept = True
+        return kept[1]
+
     def open(self):
-        f: igzip._IndexedGzipFile = igzip.IndexedGzipFile(self.name)
-        basename = os.path.basename(self.name)
-        gzindex_name = os.path.join(
-            INDEX_DIR, self.index_name, f"{basename}.gzindex"
+        f: igzip._IndexedGzipFile = igzip.IndexedGzipFile(
+            self.name, spacing=get_indexes()[self.index_name]["gzip_spacing"]
         )
-        if os.path.isfile(gzindex_name):
-            f.import_index(gzindex_name)
+        if os.path.isfile(self.gzindex_name):
+            f.import_index(self.gzindex_name)
 
         return f
 
     def export_index(self):
-        basename = os.path.basename(self.name)
-        gzindex_name = os.path.join(
-            INDEX_DIR, self.index_name, f"{basename}.gzindex"
-        )
         self.file.seek(self.file.tell() - 1)
-        self.file.export_index(gzindex_name)
+        self.file.export_index(self.gzindex_name)
+
+    def has_index(self):
+        return os.path.isfile(self.gzindex_name)
 
+    def reset_index(self):
+        if os.path.isfile(self.gzindex_name):
+            os.remove(self.gzindex_name)
 
-def fopen(name, index_name):
+    def seek_points(self):
+        return read_seek_points(self.gzindex_name)
+
+
+def fopen(name, index_name, cached=False):
+    """
+    Get opener of the file, reading gzip files through the block cache
+    with ``cached``.
+    """
     opener = TextFileOpener
     if name.endswith(".gz"):
         opener = GzipFileOpener
 
-    return opener(name, index_name)
+    return opener(name, index_name, cached)
+
+
+def keep_files(number):
+    """
+    Keep up to ``number`` gzip files open between reads in this process.
+    """
+    global _keep_files
+
+    _keep_files = number
+    while len(_kept_files) > number:
+        _, (_, f) = _kept_files.popitem(last=False)
+        f.close()
+
+
+def file_state(*names):
+    """
+    Get inodes, sizes and modification times of the files that exist.
+    """
+    state = []
+    for name in names:
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            state.append(None)
+        else:
+            state.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+    return tuple(state)
+
+
+def gzindex_fname(name, index_name):
+    basename = os.path.basename(name)
+    return os.path.join(INDEX_DIR, index_name, f"{basename}.gzindex")
+
+
+def read_seek_points(fname):
+    """
+    Read uncompressed offsets of the seek points of exported gzip index.
+
+    Only the point table is read, not the windows that follow it.
+    """
+    try:
+        f = open(fname, "rb")
+    except FileNotFoundError:
+        return []
+
+    with f:
+        header = f.read(GZINDEX_HEADER.size)
+        if len(header) < GZINDEX_HEADER.size:
+            return []
+
+        magic, version, *_, npoints = GZINDEX_HEADER.unpack(header)
+        if magic != GZINDEX_MAGIC or version not in GZINDEX_POINT:
+            return []
+
+        point = GZINDEX_POINT[version]
+        data = f.read(point.size * npoints)
+
+    return [x[1] for x in point.iter_unpack(data)]
+
+
+def open_stream(name):
+    """
+    Open file for sequential reading, without the seek points.
+    """
+    opener = gzip.open if name.endswith(".gz") else open
+    return opener(name, "rb")
+
+
+def read_head(name, size):
+    """
+    Read first ``size`` bytes of uncompressed file contents.
+    """
+    with open_stream(name) as f:
+        return f.read(size)
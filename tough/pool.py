@@ -0,0 +1,150 @@
+from collections import deque
+import multiprocessing as mp
+
+from . import get_config_snapshot, init_worker, stats
+from .config import CONF_NAME, NUM_WORKERS
+from .opener import keep_files
+
+# Stream the tasks of this worker send their results through
+_stream = None
+
+
+class Stream:
+    """
+    Channel the tasks of ``imap_streamed`` send their results through.
+
+    Every run of ``imap_streamed`` gets a number. Results of a cancelled
+    run that are still on the way are told apart by it, and its remaining
+    tasks see that they have been cancelled and stop.
+    """
+
+    def __init__(self):
+        self.queue = mp.Queue()
+        self.cancelled = mp.Value("q", 0, lock=False)
+        self.runs = 0
+
+
+def create_pool(processes=NUM_WORKERS, stream=None, open_files=0):
+    """
+    Create worker pool that reuses the config parsed in this process.
+
+    ``stream`` is the ``Stream`` for ``imap_streamed``, ``open_files`` is
+    the number of gzip files each worker keeps open between tasks.
+    """
+    return mp.Pool(
+        processes,
+        initializer=init_pool_worker,
+        initargs=(
+            CONF_NAME,
+            get_config_snapshot(),
+            stream,
+            open_files,
+            stats.worker_setup(),
+        ),
+    )
+
+
+def init_pool_worker(
+    conf_name, snapshot, stream, open_files=0, stats_setup=(None, None)
+):
+    global _stream
+
+    init_worker(conf_name, snapshot)
+    keep_files(open_files)
+    stats.init_worker(stats_setup)
+    _stream = stream
+    if stream is not None:
+        # Results of cancelled runs may be left unread, don't wait for
+        # them to be flushed when exiting.
+        stream.queue.cancel_join_thread()
+
+
+def imap_bounded(pool, func, iterable, window):
+    """
+    Like ``Pool.imap``, but the iterable is consumed in the calling thread.
+
+    ``Pool.imap`` drains its iterables one by one in the pool's own task
+    handler thread, so several threads can't feed the same pool at once.
+    Here at most ``window`` tasks are submitted ahead of the consumer.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            with stats.timer("pool.wait"):
+                result = pending.popleft().get()
+
+            yield result
+
+    while pending:
+        with stats.timer("pool.wait"):
+            result = pending.popleft().get()
+
+        yield result
+
+
+def imap_streamed(pool, stream, func, items, window):
+    """
+    Run generator ``func`` over the items, streaming what it yields.
+
+    Yields ``(item, batch)`` in the order of the items, as soon as the
+    batches arrive, and ``(item, None)`` when the item is done. At most
+    ``window`` items are in progress or waiting to be yielded, so a slow
+    consumer holds back the workers. Closing the generator early cancels
+    the tasks that are left.
+    """
+    stream.runs += 1
+    run = stream.runs
+    tasks = {}
+    batches = {}
+    done = set()
+    try:
+        for current in range(len(items)):
+            while len(tasks) < window and len(tasks) + current < len(items):
+                task_id = current + len(tasks)
+                tasks[task_id] = pool.apply_async(
+                    stream_task, (run, task_id, items[task_id], func)
+                )
+                batches[task_id] = []
+
+            while True:
+                for batch in batches[current]:
+                    yield items[current], batch
+
+                batches[current] = []
+                if current in done:
+                    break
+
+                with stats.timer("pool.wait"):
+                    task_run, task_id, batch = stream.queue.get()
+
+                if task_run != run:
+                    continue
+
+                if batch is None:
+                    done.add(task_id)
+                    tasks[task_id].get()
+                else:
+                    batches[task_id].append(batch)
+
+            del batches[current]
+            del tasks[current]
+            yield items[current], None
+
+    finally:
+        if tasks:
+            stream.cancelled.value = run
+
+
+def stream_task(run, task_id, item, func):
+    try:
+        if _stream.cancelled.value >= run:
+            return
+
+        for batch in func(item):
+            _stream.queue.put((run, task_id, batch))
+            stats.count("pool.batches_sent")
+            if _stream.cancelled.value >= run:
+                break
+    finally:
+        _stream.queue.put((run, task_id, None))
@@ -0,0 +1,190 @@
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+import json
+from multiprocessing.util import Finalize
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Timers (seconds) and counters of this process
+_timers = Counter()
+_counters = Counter()
+# Reindex updates them from several threads
+_lock = threading.Lock()
+# Directory the workers leave their stats in, set while collecting
+_trace_dir = None
+_profile_dir = None
+_profiler = None
+
+
+def enable(profile_dir=None):
+    """
+    Start collecting the stats of this process and of the pool workers
+    created from now on, with cProfile dumps in ``profile_dir``.
+    """
+    global _trace_dir, _profile_dir
+
+    _trace_dir = tempfile.mkdtemp(prefix="tough-stats-")
+    _profile_dir = profile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        start_profile(os.path.join(profile_dir, f"main-{os.getpid()}.prof"))
+
+
+def enabled():
+    return _trace_dir is not None
+
+
+def count(name, value=1):
+    if _trace_dir is not None:
+        with _lock:
+            _counters[name] += value
+
+
+@contextmanager
+def timer(name):
+    if _trace_dir is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, start)
+
+
+def timed(name, iterable):
+    """
+    Iterate adding the time spent getting every item to the timer.
+    """
+    if _trace_dir is None:
+        yield from iterable
+        return
+
+    it = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        finally:
+            add_time(name, start)
+
+        yield item
+
+
+def add_time(name, start):
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _timers[name] += elapsed
+
+
+def worker_setup():
+    """
+    Get what the pool initializer passes to ``init_worker()``.
+    """
+    return _trace_dir, _profile_dir
+
+
+def init_worker(setup):
+    """
+    Collect stats of the pool worker, to be saved when it exits.
+    """
+    global _trace_dir, _profile_dir
+
+    _trace_dir, _profile_dir = setup
+    # Forked along with the stats of the parent
+    _timers.clear()
+    _counters.clear()
+    if _trace_dir is None:
+        return
+
+    name = f"worker-{os.getpid()}"
+    if _profile_dir:
+        start_profile(os.path.join(_profile_dir, f"{name}.prof"))
+
+    # Pool workers exit normally on Pool.close(), running the finalizers
+    Finalize(
+        None, save, (os.path.join(_trace_dir, f"{name}.json"),), exitpriority=10
+    )
+
+
+def start_profile(fname):
+    global _profiler
+
+    _profiler = cProfile.Profile()
+    _profiler.enable()
+    Finalize(None, _profiler.dump_stats, (fname,), exitpriority=20)
+
+
+def save(fname):
+    with open(fname, "w") as f:
+        json.dump({"timers": _timers, "counters": _counters}, f)
+
+
+def collect():
+    """
+    Get the stats of this process and the sums over the exited workers.
+    """
+    timers = Counter()
+    counters = Counter()
+    fnames = os.listdir(_trace_dir)
+    for fname in fnames:
+        with open(os.path.join(_trace_dir, fname)) as f:
+            data = json.load(f)
+
+        timers.update(data["timers"])
+        counters.update(data["counters"])
+
+    return {
+        "main": {"timers": dict(_timers), "counters": dict(_counters)},
+        "workers": {
+            "processes": len(fnames),
+            "timers": dict(timers),
+            "counters": dict(counters),
+        },
+    }
+
+
+def report(fmt="text", wall=None, out=None):
+    """
+    Write the collected stats as a table or as JSON, and stop collecting.
+    """
+    global _trace_dir
+
+    if _profiler is not None:
+        _profiler.disable()
+
+    data = collect()
+    data["wall"] = wall
+    shutil.rmtree(_trace_dir, ignore_errors=True)
+    _trace_dir = None
+
+    out = out or sys.stderr
+    if fmt == "json":
+        out.write(json.dumps(data) + "\n")
+        return
+
+    if wall is not None:
+        out.write(f"wall time: {wall:.3f} s\n")
+
+    for process in ("main", "workers"):
+        stats = data[process]
+        if not stats["timers"] and not stats["counters"]:
+            continue
+
+        processes = stats.get("processes")
+        out.write(
+            f"{process} ({processes}):\n" if processes else f"{process}:\n"
+        )
+        for name, value in sorted(stats["timers"].items()):
+            out.write(f"  {name:<28} {value:12.3f} s\n")
+
+        for name, value in sorted(stats["counters"].items()):
+            out.write(f"  {name:<28} {value:12d}\n")
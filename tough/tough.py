@@ -1,7 +1,10 @@
 import argparse
+import time
 
+from . import stats
 from .commands.reindex import run_reindex
-from .commands.search import run_search
+from .commands.serve import run_client_search, run_serve
+from .config import PROFILE_DIR, SERVER_SOCKET, TRACE
 
 
 def run():
@@ -16,21 +19,121 @@ def run():
         "index", help="Index name to reindex", default="", nargs="?"
     )
 
+    add_stats_argument(index_parser)
+
     search_parser = subparsers.add_parser("search", help="Searcher")
     search_parser.add_argument(
         "substring", help="Substring to search", default="", nargs="?"
     )
-    search_parser.add_argument("index", help="Index to search")
+    search_parser.add_argument(
+        "index", help="Index to search, or comma-separated names and globs"
+    )
     search_parser.add_argument("-e", "--regex", help="Regex pattern")
-    search_parser.add_argument("-df", "--date-from")
-    search_parser.add_argument("-dt", "--date-to")
+    search_parser.add_argument(
+        "-w",
+        "--word",
+        action="store_true",
+        help="Match whole words only, e.g. request IDs",
+    )
+    search_parser.add_argument(
+        "-df", "--date-from", help="Date or timestamp, e.g. 2019-03-05T12:30"
+    )
+    search_parser.add_argument(
+        "-dt", "--date-to", help="Date or timestamp, inclusive"
+    )
+    search_parser.add_argument(
+        "-n",
+        "--limit",
+        "--first",
+        type=positive_int,
+        help="Stop after N matches",
+    )
+    search_parser.add_argument(
+        "-c",
+        "--count-only",
+        action="store_true",
+        help="Print the number of matches only",
+    )
+    search_parser.add_argument(
+        "-r", "--reverse", action="store_true", help="Newest matches first"
+    )
+    search_parser.add_argument(
+        "-s",
+        "--sort",
+        action="store_true",
+        help="Order the matches by their timestamps across the files",
+    )
+    search_parser.add_argument(
+        "-f",
+        "--follow",
+        action="store_true",
+        help="Keep searching lines appended to the files",
+    )
+    search_parser.add_argument(
+        "--count-by",
+        type=lambda x: x.split(","),
+        help="Print the number of matches per day, hour, minute, index, file "
+        "and/or regex group, e.g. hour,file",
+    )
+
+    add_stats_argument(search_parser)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Keep workers running to serve searches"
+    )
+    serve_parser.add_argument(
+        "--socket",
+        dest="socket_name",
+        default=SERVER_SOCKET,
+        help=f"Unix socket to listen at, {SERVER_SOCKET} by default",
+    )
 
     args = main_parser.parse_args()
     dict_args = args.__dict__
 
-    commands = {"search": run_search, "reindex": run_reindex}
+    commands = {
+        "search": run_client_search,
+        "reindex": run_reindex,
+        "serve": run_serve,
+    }
+
+    stats_format = dict_args.pop("stats_format")
+    if dict_args.pop("stats") and not stats_format:
+        stats_format = "text"
+
+    if TRACE and not stats_format:
+        stats_format = "json" if TRACE == "json" else "text"
+
+    if stats_format:
+        stats.enable(PROFILE_DIR)
+
+    start = time.perf_counter()
+    try:
+        commands[dict_args.pop("command")](**dict_args)
+    finally:
+        if stats_format:
+            stats.report(stats_format, time.perf_counter() - start)
+
+
+def add_stats_argument(parser):
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timers and counters of the stages to stderr",
+    )
+    parser.add_argument(
+        "--stats-format",
+        choices=("text", "json"),
+        help="Print the stats as a summary (text) or as JSON, implies --stats",
+    )
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"should be 1 or more: {value}")
 
-    commands[dict_args.pop("command")](**dict_args)
+    return number
 
 
 if __name__ == "__main__":  # pragma: no cover
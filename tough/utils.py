@@ -1,20 +1,86 @@
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import os
 import re
 
 from . import get_indexes
 from .config import INDEX_DIR
 
+# Date index bucket key formats, from the coarsest to the finest
+GRANULARITIES = {
+    "day": ("%Y-%m-%d", timedelta(days=1)),
+    "hour": ("%Y-%m-%dT%H", timedelta(hours=1)),
+    "minute": ("%Y-%m-%dT%H:%M", timedelta(minutes=1)),
+}
 
-def date_range(str_d1, str_d2):
-    fmt = "%Y-%m-%d"
+# Accepted -df/-dt formats and the time span each of them denotes
+DATE_ARG_FORMATS = [
+    ("%Y-%m-%d", timedelta(days=1)),
+    ("%Y-%m-%dT%H", timedelta(hours=1)),
+    ("%Y-%m-%dT%H:%M", timedelta(minutes=1)),
+    ("%Y-%m-%dT%H:%M:%S", timedelta(seconds=1)),
+]
 
-    d1 = datetime.strptime(str_d1, fmt)
-    d2 = datetime.strptime(str_d2, fmt)
+# UTC offset with a colon, which %z accepts on Python 3.7+ only
+OFFSET_COLON = re.compile(r"([+-]\d\d):(\d\d)$")
 
-    while d1.date() <= d2.date():
-        yield str(d1.date())
-        d1 += timedelta(days=1)
+
+def date_range(str_d1, str_d2, granularity="day"):
+    fmt, step = GRANULARITIES[granularity]
+
+    d1 = bucket_start(parse_date_arg(str_d1)[0], granularity)
+    d2 = parse_date_arg(str_d2, end=True)[0]
+
+    while d1 <= d2:
+        yield d1.strftime(fmt)
+        d1 += step
+
+
+def parse_date_arg(value, end=False):
+    """
+    Parse date or timestamp given in command line as UTC datetime.
+
+    A date, an hour or a minute denotes the whole period, so with
+    ``end=True`` the last moment of the period is returned.
+    Returns the datetime and the precision of the value.
+    """
+    value = value.strip().replace(" ", "T")
+    for fmt, precision in DATE_ARG_FORMATS:
+        for tz_fmt in ("", "%z"):
+            try:
+                dt = datetime.strptime(value, fmt + tz_fmt)
+            except ValueError:
+                continue
+
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+
+            dt = dt.astimezone(timezone.utc)
+            if end:
+                dt += precision - timedelta(microseconds=1)
+
+            return dt, precision
+
+    raise ValueError(f"Wrong date: {value}")
+
+
+def bucket_start(dt, granularity="day"):
+    fmt, _ = GRANULARITIES[granularity]
+    return datetime.strptime(dt.strftime(fmt), fmt).replace(tzinfo=timezone.utc)
+
+
+def bisect_lines(lo, hi, predicate):
+    """
+    Find the first line in ``[lo, hi)`` for which ``predicate`` holds.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if predicate(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return lo
 
 
 def ensure_index_dir(index_dir=INDEX_DIR):
@@ -28,13 +94,129 @@ def get_datetime(row, index_name):
         row,
         indexes[index_name]["datetime_regex"],
         indexes[index_name]["datetime_format"],
+        indexes[index_name]["date_granularity"],
     )
 
 
-def get_datetime_ex(row, regex, fmt):
-    m = re.search(regex.encode(), row)
-    if not m:
-        raise ValueError
+def get_datetime_ex(row, regex, fmt, granularity="day"):
+    return get_extractor(regex, fmt, granularity).bucket(row)
+
+
+def parse_datetime_ex(row, regex, fmt):
+    return get_extractor(regex, fmt).parse(row)
+
+
+@lru_cache(maxsize=None)
+def get_extractor(regex, fmt, granularity="day"):
+    return DatetimeExtractor(regex, fmt, granularity)
+
+
+class DatetimeExtractor:
+    """
+    Datetime extractor for rows of an index.
+
+    The regex is compiled once, well-known formats are parsed without
+    strptime unless a timestamp is laid out differently, and the bucket of
+    the previous row is reused while the timestamp differs from it only in
+    seconds.
+    """
+
+    def __init__(self, regex, fmt, granularity="day"):
+        self.regex = re.compile(regex.encode())
+        self.fmt = fmt
+        self.bucket_fmt = GRANULARITIES[granularity][0]
+        self.parse_fast, self.memo_key = FAST_FORMATS.get(fmt, (None, None))
+        self.parse_raw = self.strptime
+        if self.parse_fast is not None:
+            self.parse_raw = self.parse_or_strptime
+
+        self.last = (None, None)
+
+    def parse(self, row):
+        return self.parse_raw(self.extract(row))
+
+    def bucket(self, row):
+        raw = self.extract(row)
+        key = self.memo_key(raw) if self.memo_key else raw
+        last_key, last_bucket = self.last
+        if key == last_key:
+            return last_bucket
+
+        bucket = self.parse_raw(raw).strftime(self.bucket_fmt)
+        self.last = (key, bucket)
+        return bucket
+
+    def extract(self, row):
+        m = self.regex.search(row)
+        if not m:
+            raise ValueError
+
+        return m.group(1)
+
+    def parse_or_strptime(self, raw):
+        try:
+            return self.parse_fast(raw)
+        except ValueError:
+            # E.g. lowercase month or offset with a colon
+            return self.strptime(raw)
+
+    def strptime(self, raw):
+        raw = raw.decode()
+        if "%z" in self.fmt:
+            raw = OFFSET_COLON.sub(r"\1\2", raw)
+
+        dt = datetime.strptime(raw, self.fmt)
+        return dt.astimezone(timezone.utc)
+
+
+MONTHS = {
+    m: i
+    for i, m in enumerate(
+        b"Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), 1
+    )
+}
+
+
+def is_clf(raw):
+    return len(raw) == 26 and raw[21:22] in (b"+", b"-")
+
+
+def parse_clf(raw):
+    """
+    Parse Common Log Format (nginx, Apache) timestamp.
+
+    E.g. ``20/Feb/2019:12:34:56 +0300``.
+    """
+    if not is_clf(raw):
+        raise ValueError(f"Wrong timestamp: {raw}")
+
+    try:
+        dt = datetime(
+            int(raw[7:11]),
+            MONTHS[raw[3:6]],
+            int(raw[0:2]),
+            int(raw[12:14]),
+            int(raw[15:17]),
+            int(raw[18:20]),
+            tzinfo=timezone.utc,
+        )
+    except KeyError:
+        raise ValueError(f"Wrong timestamp: {raw}") from None
+
+    tz_offset = timedelta(hours=int(raw[22:24]), minutes=int(raw[24:26]))
+    if raw[21:22] == b"-":
+        tz_offset = -tz_offset
+
+    return dt - tz_offset
+
+
+def clf_memo_key(raw):
+    # Timezone offsets are whole minutes, so seconds never change a bucket
+    if not is_clf(raw):
+        return raw
+
+    return raw[:17] + raw[20:]
+
 
-    dt = datetime.strptime(m.group(1).decode(), fmt)
-    return str(dt.astimezone(timezone.utc).date())
+# strptime format -> (parser, memoization key for buckets)
+FAST_FORMATS = {"%d/%b/%Y:%H:%M:%S %z": (parse_clf, clf_memo_key)}